@@ -0,0 +1,107 @@
+import os
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('xpublish-host benchmarks')
+    group.addoption(
+        '--archive-files',
+        type=int,
+        default=int(os.environ.get('XPUB_BENCH_FILES', 24)),
+        help='Number of netCDF files in the synthetic archive',
+    )
+    group.addoption(
+        '--archive-steps',
+        type=int,
+        default=int(os.environ.get('XPUB_BENCH_STEPS', 24)),
+        help='Number of time steps in each file',
+    )
+    group.addoption(
+        '--archive-grid',
+        type=int,
+        default=int(os.environ.get('XPUB_BENCH_GRID', 100)),
+        help='Size of each of the x and y dimensions',
+    )
+
+
+@dataclass
+class Archive:
+    path: Path
+    files: int
+    steps: int
+    grid: int
+
+    @property
+    def file_glob(self) -> str:
+        return '*.nc'
+
+
+def write_archive(path: Path, files: int, steps: int, grid: int):
+    """
+    A directory of hourly netCDF files along a time dimension with
+    a curvilinear-looking grid and one float32 variable
+    """
+    path.mkdir(parents=True, exist_ok=True)
+    y, x = np.arange(grid), np.arange(grid)
+    lon = -150 + (x[np.newaxis, :] + 0.1 * y[:, np.newaxis]) * 0.01
+    lat = 50 + (y[:, np.newaxis] + 0.1 * x[np.newaxis, :]) * 0.01
+    rng = np.random.default_rng(0)
+
+    for i in range(files):
+        times = pd.date_range('2023-01-01', periods=steps, freq='h') + pd.Timedelta(hours=steps * i)
+        ds = xr.Dataset(
+            {
+                'temp': (
+                    ('time', 'y', 'x'),
+                    rng.random((steps, grid, grid), dtype='float32'),
+                ),
+            },
+            coords={
+                'time': times,
+                'y': y,
+                'x': x,
+                'lon': (('y', 'x'), lon),
+                'lat': (('y', 'x'), lat),
+            },
+        )
+        ds.to_netcdf(path / f'archive_{i:05d}.nc', engine='netcdf4')
+
+
+@pytest.fixture(scope='session')
+def archive(request, tmp_path_factory) -> Archive:
+    files = request.config.getoption('--archive-files')
+    steps = request.config.getoption('--archive-steps')
+    grid = request.config.getoption('--archive-grid')
+    path = tmp_path_factory.mktemp(f'archive_{files}x{steps}x{grid}')
+    write_archive(path, files, steps, grid)
+    return Archive(path=path, files=files, steps=steps, grid=grid)
+
+
+@pytest.fixture
+def measure(benchmark):
+    """
+    Benchmark the wall time of a function and record the peak memory
+    allocated during one extra run (traced separately, tracing slows
+    everything down) in the benchmark's `extra_info`
+    """
+    def run(func, *args, **kwargs):
+        result = benchmark(func, *args, **kwargs)
+
+        tracemalloc.start()
+        try:
+            func(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info['peak_memory_mb'] = round(peak / 2 ** 20, 3)
+
+        return result
+
+    return run
@@ -0,0 +1,103 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from xpublish_host.config import PluginConfig, RestConfig
+from xpublish_host.plugins import DatasetConfig
+
+DATASET_ID = 'archive'
+
+
+@pytest.fixture(scope='module')
+def client(archive):
+    dc = DatasetConfig(
+        id=DATASET_ID,
+        title='Archive',
+        description='Synthetic netCDF archive',
+        loader='xpublish_host.loaders.mfdataset.load_mfdataset',
+        kwargs=dict(
+            root_path=str(archive.path),
+            file_glob=archive.file_glob,
+            axes=dict(t='time', x='x', y='y'),
+        ),
+    )
+    config = RestConfig(
+        plugins_config={
+            'zarr': PluginConfig(
+                module='xpublish.plugins.included.zarr.ZarrPlugin',
+            ),
+            'dconfig': PluginConfig(
+                module='xpublish_host.plugins.DatasetsConfigPlugin',
+                kwargs=dict(datasets_config={ DATASET_ID: dc }),
+            ),
+            'data_points': PluginConfig(
+                module='xpublish_host.plugins.DataPointsPlugin',
+                # Measure building responses, not the response cache
+                kwargs=dict(cache_max_bytes=0),
+            ),
+        }
+    )
+    rest = config.setup()
+    return TestClient(rest.app)
+
+
+def get(client, url, **params):
+    response = client.get(url, params=params)
+    assert response.status_code == 200
+    return response
+
+
+@pytest.mark.parametrize('fmt', ['.jsonl', '.parquet', '.arrow', '.records'])
+def test_data_points_time_series(client, measure, fmt):
+    # One grid cell over the whole archive
+    measure(
+        get,
+        client,
+        f'/datasets/{DATASET_ID}/data_points/filter{fmt}',
+        time_var='time',
+        x_var='x',
+        y_var='y',
+        var='temp',
+        x_start=10,
+        x_end=10,
+        y_start=10,
+        y_end=10,
+    )
+
+
+@pytest.mark.parametrize('fmt', ['.jsonl', '.parquet', '.arrow'])
+def test_data_points_map(client, measure, fmt):
+    # The whole grid at one time step
+    measure(
+        get,
+        client,
+        f'/datasets/{DATASET_ID}/data_points/filter{fmt}',
+        time_var='time',
+        time_start='2023-01-01T00:00:00',
+        time_end='2023-01-01T00:00:00',
+        x_var='x',
+        y_var='y',
+        var='temp',
+    )
+
+
+def test_data_points_nearest(client, measure):
+    pytest.importorskip('scipy')
+    measure(
+        get,
+        client,
+        f'/datasets/{DATASET_ID}/data_points/filter.parquet',
+        time_var='time',
+        x_var='lon',
+        y_var='lat',
+        var='temp',
+        longitude='-149.5,-149.9',
+        latitude='50.2,50.5',
+    )
+
+
+def test_zarr_metadata(client, measure):
+    measure(get, client, f'/datasets/{DATASET_ID}/zarr/.zmetadata')
+
+
+def test_zarr_chunk(client, measure):
+    measure(get, client, f'/datasets/{DATASET_ID}/zarr/temp/0.0.0')
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from xpublish_host.loaders.dataset import load_dataset_zarr
+from xpublish_host.loaders.mfdataset import load_mfdataset
+
+
+def mfdataset_kwargs(archive):
+    return dict(
+        root_path=archive.path,
+        file_glob=archive.file_glob,
+        axes=dict(t='time', x='x', y='y'),
+    )
+
+
+def test_load_mfdataset(archive, measure):
+    ds = measure(load_mfdataset, **mfdataset_kwargs(archive))
+    assert ds.sizes['time'] == archive.files * archive.steps
+
+
+def test_load_mfdataset_indexed(archive, measure, tmp_path):
+    kwargs = dict(mfdataset_kwargs(archive), index_file=tmp_path / 'index.json')
+    # Build the index before measuring, reloads only read the index
+    load_mfdataset(**kwargs)
+    ds = measure(load_mfdataset, **kwargs)
+    assert ds.sizes['time'] == archive.files * archive.steps
+
+
+def test_load_mfdataset_append_only(archive, measure):
+    kwargs = dict(mfdataset_kwargs(archive), append_only=True)
+    # Reloads without any new files re-use the previous dataset
+    load_mfdataset(**kwargs)
+    ds = measure(load_mfdataset, **kwargs)
+    assert ds.sizes['time'] == archive.files * archive.steps
+
+
+@pytest.fixture(scope='module')
+def references(archive, tmp_path_factory):
+    pytest.importorskip('kerchunk')
+    from kerchunk.combine import MultiZarrToZarr
+    from kerchunk.hdf import SingleHdf5ToZarr
+
+    singles = [
+        SingleHdf5ToZarr(str(f)).translate()
+        for f in sorted(archive.path.glob(archive.file_glob))
+    ]
+    combined = MultiZarrToZarr(
+        singles,
+        concat_dims=['time'],
+        identical_dims=['x', 'y', 'lon', 'lat'],
+        # Each file encodes time relative to its own first step
+        coo_map={'time': 'cf:time'},
+    ).translate()
+
+    path = tmp_path_factory.mktemp('references') / 'references.json'
+    with open(path, 'w') as f:
+        json.dump(combined, f)
+    return path
+
+
+def test_load_dataset_zarr(archive, references, measure):
+    ds = measure(load_dataset_zarr, str(references))
+    assert ds.sizes['time'] == archive.files * archive.steps
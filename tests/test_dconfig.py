@@ -0,0 +1,756 @@
+import logging
+import os
+import threading
+import time
+
+import dask.array as da
+import numpy as np
+import pytest
+import xarray as xr
+from fastapi.testclient import TestClient
+
+from xpublish_host.app import setup_xpublish
+from xpublish_host.config import PluginConfig, RestConfig
+from xpublish_host.plugins import DatasetConfig, DatasetsConfigPlugin
+
+from .utils import simple_loader
+
+L = logging.getLogger(__name__)
+
+
+class SlowLoader:
+
+    def __init__(self, delay=0.5, gate=None):
+        self.delay = delay
+        # Loads wait for the gate to be set
+        self.gate = gate
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.calls += 1
+        if self.gate is not None:
+            assert self.gate.wait(10)
+        time.sleep(self.delay)
+        ds = simple_loader()
+        ds.attrs['load'] = self.calls
+        return ds
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_background_reload():
+    gate = threading.Event()
+    gate.set()
+    loader = SlowLoader(delay=0, gate=gate)
+    dc = DatasetConfig(
+        id='bg',
+        title='Title',
+        description='Description',
+        loader=loader,
+        invalidate_after=1,
+        background_reload=True,
+    )
+    plugin = DatasetsConfigPlugin(datasets_config={'bg': dc})
+    assert loader.calls == 1
+    first = plugin.get_dataset('bg')
+
+    # Reloads wait until the gate is set again
+    gate.clear()
+    time.sleep(1.1)
+
+    # Expired: every request gets the stale dataset without waiting for
+    # the reload and only one reload is started
+    for _ in range(10):
+        assert plugin.get_dataset('bg') is first
+    wait_for(lambda: loader.calls == 2)
+    assert plugin.get_dataset('bg') is first
+    assert loader.calls == 2
+
+    gate.set()
+    wait_for(lambda: plugin.dataset_generation('bg') == 2)
+    reloaded = plugin.get_dataset('bg')
+    assert reloaded is not first
+    assert reloaded.attrs['load'] == 2
+
+
+def test_coalesced_load():
+    loader = SlowLoader()
+    dc = DatasetConfig(
+        id='coalesced',
+        title='Title',
+        description='Description',
+        loader=loader,
+        skip_initial_load=True,
+    )
+    plugin = DatasetsConfigPlugin(datasets_config={'key': dc})
+    assert plugin.get_datasets() == ['coalesced']
+    assert plugin.get_dataset('key') is None
+
+    # Concurrent first requests share one load
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(plugin.get_dataset('coalesced')))
+        for _ in range(5)
+    ]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    assert loader.calls == 1
+    assert all(r is results[0] for r in results)
+    assert plugin.dataset_generation('coalesced') == 1
+
+
+def test_shared_cache(tmp_path):
+    loader = SlowLoader(delay=0)
+    dc = DatasetConfig(
+        id='shared',
+        title='Title',
+        description='Description',
+        loader=loader,
+        invalidate_after=60,
+    )
+
+    # Two plugins sharing a directory act like two worker processes
+    first = DatasetsConfigPlugin(datasets_config={'shared': dc}, shared_cache_dir=tmp_path)
+    second = DatasetsConfigPlugin(datasets_config={'shared': dc}, shared_cache_dir=tmp_path)
+    assert loader.calls == 1
+    assert first.get_dataset('shared').identical(second.get_dataset('shared'))
+    assert len(list((tmp_path / 'shared').glob('*.pickle'))) == 1
+
+    # A changed config does not use the shared dataset
+    changed = dc.model_copy(update={'args': ['ignored']})
+    assert changed.fingerprint() != dc.fingerprint()
+
+
+def test_shared_cache_runs(tmp_path, monkeypatch):
+    from xpublish_host.plugins.dcache import RUN_ENV
+
+    loader = SlowLoader(delay=0)
+    dc = DatasetConfig(
+        id='shared',
+        title='Title',
+        description='Description',
+        loader=loader,
+    )
+
+    monkeypatch.setenv(RUN_ENV, 'first')
+    DatasetsConfigPlugin(datasets_config={'shared': dc}, shared_cache_dir=tmp_path)
+    DatasetsConfigPlugin(datasets_config={'shared': dc}, shared_cache_dir=tmp_path)
+    assert loader.calls == 1
+
+    # A restarted server does not use datasets shared by the previous run
+    monkeypatch.setenv(RUN_ENV, 'second')
+    DatasetsConfigPlugin(datasets_config={'shared': dc}, shared_cache_dir=tmp_path)
+    assert loader.calls == 2
+    assert [ p.name.split('.')[0] for p in (tmp_path / 'shared').glob('*.pickle') ] == ['second']
+
+    # Sharing a dataset leaves the files of datasets with a similar id alone
+    daily = dc.model_copy(update={'id': 'shared.daily'})
+    DatasetsConfigPlugin(datasets_config={'shared.daily': daily}, shared_cache_dir=tmp_path)
+    monkeypatch.setenv(RUN_ENV, 'third')
+    DatasetsConfigPlugin(datasets_config={'shared': dc}, shared_cache_dir=tmp_path)
+    assert len(list((tmp_path / 'shared.daily').glob('*.pickle'))) == 1
+
+
+def test_shared_cache_permissions(tmp_path):
+    loader = SlowLoader(delay=0)
+    dc = DatasetConfig(
+        id='shared',
+        title='Title',
+        description='Description',
+        loader=loader,
+    )
+
+    # Created only accessible to the current user
+    DatasetsConfigPlugin(datasets_config={'shared': dc}, shared_cache_dir=tmp_path / 'new')
+    assert (tmp_path / 'new').stat().st_mode & 0o777 == 0o700
+
+    # Pickles in a directory other users can write to are never read
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    shared.chmod(0o777)
+    first = DatasetsConfigPlugin(datasets_config={'shared': dc}, shared_cache_dir=shared)
+    DatasetsConfigPlugin(datasets_config={'shared': dc}, shared_cache_dir=shared)
+    assert loader.calls == 3
+    assert list(shared.iterdir()) == []
+    assert first.get_dataset('shared') is not None
+
+
+def test_parallel_initial_load():
+    loaders = { f'ds{i}': SlowLoader() for i in range(3) }
+    configs = {
+        k: DatasetConfig(
+            id=k,
+            title='Title',
+            description='Description',
+            loader=v,
+        )
+        for k, v in loaders.items()
+    }
+
+    start = time.monotonic()
+    plugin = DatasetsConfigPlugin(datasets_config=configs, initial_load_workers=3)
+    assert time.monotonic() - start < 1.5 * SlowLoader().delay
+    for k, v in loaders.items():
+        assert v.calls == 1
+        assert plugin.get_dataset(k).attrs['load'] == 1
+
+
+def test_initial_load_timeout():
+    loader = SlowLoader(delay=1)
+    dc = DatasetConfig(
+        id='slow',
+        title='Title',
+        description='Description',
+        loader=loader,
+        load_timeout=0.1,
+    )
+
+    start = time.monotonic()
+    plugin = DatasetsConfigPlugin(datasets_config={'slow': dc})
+    assert time.monotonic() - start < loader.delay
+
+    # The load keeps going in the background and is used once it finishes
+    wait_for(lambda: plugin.datasets_status()['slow']['state'] == 'loaded')
+    assert plugin.get_dataset('slow').attrs['load'] == 1
+    assert loader.calls == 1
+
+
+def test_initial_load_timeout_queued():
+    slow = SlowLoader(delay=1)
+    fast = SlowLoader(delay=0)
+    configs = {
+        'slow': DatasetConfig(
+            id='slow',
+            title='Title',
+            description='Description',
+            loader=slow,
+            load_timeout=0.1,
+        ),
+        'fast': DatasetConfig(
+            id='fast',
+            title='Title',
+            description='Description',
+            loader=fast,
+        ),
+    }
+
+    # The timed out load does not keep the only worker from loading the next dataset
+    start = time.monotonic()
+    plugin = DatasetsConfigPlugin(datasets_config=configs, initial_load_workers=1)
+    assert time.monotonic() - start < slow.delay / 2
+    assert fast.calls == 1
+    assert plugin.datasets_status()['fast']['state'] == 'loaded'
+
+    wait_for(lambda: plugin.datasets_status()['slow']['state'] == 'loaded')
+    assert plugin.get_dataset('slow').attrs['load'] == 1
+    assert slow.calls == 1
+
+
+def test_ready(monkeypatch):
+    monkeypatch.setenv('XPUB_METRICS_DISABLE', '1')
+    loader = SlowLoader(delay=1)
+    config = RestConfig(
+        plugins_config={
+            'dconfig': PluginConfig(
+                module='xpublish_host.plugins.DatasetsConfigPlugin',
+                kwargs=dict(datasets_config={
+                    'slow': DatasetConfig(
+                        id='slow',
+                        title='Title',
+                        description='Description',
+                        loader=loader,
+                        load_timeout=0.1,
+                    ),
+                    'lazy': DatasetConfig(
+                        id='lazy',
+                        title='Title',
+                        description='Description',
+                        loader=simple_loader,
+                        skip_initial_load=True,
+                    ),
+                })
+            ),
+        }
+    )
+    rest, _ = setup_xpublish(config)
+    client = TestClient(rest.app)
+
+    # Still loading a dataset that is loaded on startup
+    response = client.get('/ready')
+    assert response.status_code == 503
+    datasets = response.json()['datasets']
+    assert datasets['slow']['state'] == 'loading'
+    assert datasets['lazy']['state'] == 'not_loaded'
+    assert datasets['lazy']['required'] is False
+
+    time.sleep(loader.delay * 1.5)
+    response = client.get('/ready')
+    assert response.status_code == 200
+    datasets = response.json()['datasets']
+    assert datasets['slow']['state'] == 'loaded'
+    assert datasets['slow']['age'] >= 0
+
+    # The health check does not depend on the datasets
+    assert client.get('/health').status_code == 200
+
+
+def test_failed_status():
+    def failing_loader():
+        raise ValueError('broken')
+
+    dc = DatasetConfig(
+        id='broken',
+        title='Title',
+        description='Description',
+        loader=failing_loader,
+        skip_initial_load=True,
+    )
+    plugin = DatasetsConfigPlugin(datasets_config={'broken': dc})
+    with pytest.raises(ValueError):
+        plugin.get_dataset('broken')
+
+    status = plugin.datasets_status()['broken']
+    assert status['state'] == 'failed'
+    assert status['error'] == 'broken'
+    assert status['available'] is False
+
+
+def test_warmup():
+    def lazy_loader():
+        return simple_loader().assign_coords(
+            lon=('x', da.from_array(np.array([1., 2., 3.]), chunks=1))
+        )
+
+    dc = DatasetConfig(
+        id='warm',
+        title='Title',
+        description='Description',
+        loader=lazy_loader,
+        warmup=True,
+    )
+    plugin = DatasetsConfigPlugin(datasets_config={'warm': dc})
+    ds = plugin.get_dataset('warm')
+    assert ds.lon.chunks is None
+    assert ds.lon.values.tolist() == [1., 2., 3.]
+
+
+def test_materialize():
+    def lazy_loader():
+        return xr.Dataset(
+            {
+                'big': (('time', 'x'), np.arange(40.).reshape(10, 4)),
+                'small': ('x', np.arange(4.)),
+            },
+            coords={
+                'time': np.arange(10),
+                'lon': ('x', np.array([1., 2., 3., 4.])),
+            },
+        ).chunk(time=2)
+
+    dc = DatasetConfig(
+        id='materialize',
+        title='Title',
+        description='Description',
+        loader=lazy_loader,
+        materialize=dict(
+            memory_budget=200,
+            max_variable_bytes=100,
+            tail_variables=['big'],
+            tail_steps=3,
+        ),
+    )
+    plugin = DatasetsConfigPlugin(datasets_config={'materialize': dc})
+    ds = plugin.get_dataset('materialize')
+    assert ds.lon.chunks is None
+    assert ds.small.chunks is None
+    # Still lazy with the same chunks, the last steps are in memory
+    assert ds.big.chunks == ((2, 2, 2, 2, 2), (4,))
+    assert ds.big.values.tolist() == lazy_loader().big.values.tolist()
+
+    # The tail does not fit in a smaller budget
+    dc = dc.model_copy(update={'materialize': dc.materialize.model_copy(update={'memory_budget': 64})})
+    ds = dc.load()
+    assert ds.lon.chunks is None
+    assert ds.small.chunks is None
+    assert len(ds.big.data.dask) == len(lazy_loader().big.data.dask)
+
+
+def test_evict_datasets():
+    loaders = { k: SlowLoader(delay=0) for k in ['a', 'b', 'c'] }
+    configs = {
+        k: DatasetConfig(
+            id=k,
+            title='Title',
+            description='Description',
+            loader=v,
+            skip_initial_load=True,
+        )
+        for k, v in loaders.items()
+    }
+    plugin = DatasetsConfigPlugin(datasets_config=configs, max_open_datasets=2)
+    plugin.get_dataset('a')
+    plugin.get_dataset('b')
+    plugin.get_dataset('a')
+
+    # b is the least recently used
+    plugin.get_dataset('c')
+    status = plugin.datasets_status()
+    assert status['b']['state'] == 'evicted'
+    assert status['b']['available'] is False
+    assert status['a']['available'] is True
+    assert status['c']['available'] is True
+
+    # and is loaded again on the next request
+    assert plugin.get_dataset('b').attrs['load'] == 2
+    assert plugin.datasets_status()['a']['state'] == 'evicted'
+
+
+def test_evict_datasets_memory():
+    configs = {
+        k: DatasetConfig(
+            id=k,
+            title='Title',
+            description='Description',
+            loader=simple_loader,
+        )
+        for k in ['a', 'b']
+    }
+    size = simple_loader().nbytes
+    plugin = DatasetsConfigPlugin(datasets_config=configs, max_datasets_memory=size)
+    status = plugin.datasets_status()
+    assert sum(s['available'] for s in status.values()) == 1
+    # Evicted datasets don't hold up readiness
+    assert not any(s['required'] and not s['available'] for s in status.values())
+
+
+def test_dataset_memory():
+    from xpublish_host.plugins.dconfig import dataset_memory
+
+    ds = xr.Dataset({
+        'lazy': ('x', da.zeros(100, chunks=10)),
+        'computed': ('x', np.zeros(100)),
+    })
+    # Only arrays that are not dask backed
+    assert dataset_memory(ds) == ds.computed.nbytes
+
+
+def test_config_reload(tmp_path):
+    def write_config(**datasets):
+        lines = ['datasets_config:']
+        for k, title in datasets.items():
+            lines += [
+                f'  {k}:',
+                f'    id: {k}',
+                f'    title: {title}',
+                '    description: Description',
+                '    loader: tests.utils.simple_loader',
+            ]
+        config_file.write_text('\n'.join(lines) + '\n')
+        # Make sure the change is noticed on file systems with coarse times
+        stat = config_file.stat()
+        os.utime(config_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    config_file = tmp_path / 'datasets.yaml'
+    write_config(kept='Kept', changed='Changed', removed='Removed')
+    plugin = DatasetsConfigPlugin(
+        datasets_config_file=config_file,
+        config_poll_interval=0,
+    )
+    kept = plugin.get_dataset('kept')
+    changed = plugin.get_dataset('changed')
+    assert sorted(plugin.get_datasets()) == ['changed', 'kept', 'removed']
+
+    write_config(kept='Kept', changed='Changed again', added='Added')
+    assert sorted(plugin.get_datasets()) == ['added', 'changed', 'kept']
+    assert plugin.get_dataset('removed') is None
+    assert 'removed' not in plugin.datasets_status()
+
+    # Added and changed datasets are (re)loaded in the background
+    wait_for(
+        lambda: plugin.dataset_generation('added') == 1
+        and plugin.dataset_generation('changed') == 2
+    )
+    assert plugin.get_dataset('kept') is kept
+    assert plugin.get_dataset('changed') is not changed
+    assert plugin.dataset_generation('added') == 1
+
+
+gated = threading.Event()
+gated_calls = []
+
+
+def gated_loader():
+    gated_calls.append(1)
+    assert gated.wait(10)
+    return simple_loader()
+
+
+def test_config_removed_while_loading(tmp_path):
+    config_file = tmp_path / 'datasets.yaml'
+
+    def write_config(lines):
+        config_file.write_text('\n'.join(['datasets_config:'] + lines) + '\n')
+        stat = config_file.stat()
+        os.utime(config_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    gated_config = [
+        '  gated:',
+        '    id: gated',
+        '    title: Title',
+        '    description: Description',
+        '    loader: tests.test_dconfig.gated_loader',
+        '    skip_initial_load: true',
+    ]
+    write_config(gated_config)
+    plugin = DatasetsConfigPlugin(
+        datasets_config_file=config_file,
+        config_poll_interval=0,
+    )
+    gated.clear()
+    gated_calls.clear()
+
+    # Remove the dataset from the config file while it is loading
+    loading = threading.Thread(
+        target=plugin.load_dataset,
+        args=(plugin.datasets_config['gated'],)
+    )
+    loading.start()
+    write_config(['  {}'])
+    polling = threading.Thread(target=plugin.get_datasets)
+    polling.start()
+    wait_for(lambda: 'gated' not in plugin.datasets_config)
+    gated.set()
+    loading.join()
+    polling.join()
+    assert plugin.get_datasets() == []
+
+    # The load that finished after the removal was not kept
+    write_config(gated_config)
+    assert plugin.get_datasets() == ['gated']
+    assert plugin.get_dataset('gated') is not None
+    assert len(gated_calls) == 2
+
+
+def test_config_changed_while_reloading(tmp_path):
+    config_file = tmp_path / 'datasets.yaml'
+
+    def write_config(title):
+        lines = [
+            'datasets_config:',
+            '  gated:',
+            '    id: gated',
+            f'    title: {title}',
+            '    description: Description',
+            '    loader: tests.test_dconfig.gated_loader',
+        ]
+        config_file.write_text('\n'.join(lines) + '\n')
+        stat = config_file.stat()
+        os.utime(config_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    write_config('First')
+    gated.set()
+    gated_calls.clear()
+    plugin = DatasetsConfigPlugin(
+        datasets_config_file=config_file,
+        config_poll_interval=0,
+    )
+    assert plugin.dataset_generation('gated') == 1
+    gated.clear()
+
+    # Change the config again while the reload of the first change is in-flight
+    write_config('Second')
+    plugin.get_datasets()
+    wait_for(lambda: len(gated_calls) == 2)
+    write_config('Third')
+    plugin.get_datasets()
+    gated.set()
+
+    # The dataset is reloaded again with the latest config
+    wait_for(lambda: plugin.dataset_generation('gated') == 3)
+    assert plugin.datasets_config['gated'].title == 'Third'
+    assert len(gated_calls) == 3
+
+
+def test_admin_routes(tmp_path, monkeypatch):
+    monkeypatch.setenv('XPUB_METRICS_DISABLE', '1')
+    loader = SlowLoader(delay=0)
+    dc = DatasetConfig(
+        id='admin',
+        title='Title',
+        description='Description',
+        loader=loader,
+    )
+    kwargs = dict(
+        datasets_config={'admin': dc},
+        admin_token='secret',
+        admin_signal_dir=tmp_path,
+        admin_poll_interval=0,
+    )
+    config = RestConfig(
+        plugins_config={
+            'dconfig': PluginConfig(
+                module='xpublish_host.plugins.DatasetsConfigPlugin',
+                kwargs=kwargs,
+            ),
+        }
+    )
+    rest, _ = setup_xpublish(config)
+    client = TestClient(rest.app)
+    # Another process on the node
+    other = DatasetsConfigPlugin(**kwargs)
+    assert loader.calls == 2
+
+    url = '/admin/datasets/admin/invalidate'
+    assert client.post(url).status_code == 401
+    assert client.post(url, headers={'Authorization': 'Bearer wrong'}).status_code == 401
+
+    headers = {'Authorization': 'Bearer secret'}
+    assert client.post('/admin/datasets/missing/reload', headers=headers).status_code == 404
+    assert client.post('/admin/datasets/admin/unknown', headers=headers).status_code == 422
+
+    response = client.post(url, headers=headers)
+    assert response.status_code == 202
+    assert response.json()['processes'] == 'all'
+
+    # The other process drops the dataset and loads it on the next request
+    assert other.get_dataset('admin').attrs['load'] == 3
+    assert loader.calls == 3
+    # and only applies each action once
+    other.get_dataset('admin')
+    assert loader.calls == 3
+
+
+def test_admin_routes_disabled(monkeypatch):
+    monkeypatch.setenv('XPUB_METRICS_DISABLE', '1')
+    monkeypatch.delenv('XPUB_ADMIN_TOKEN', raising=False)
+    config = RestConfig(
+        plugins_config={
+            'dconfig': PluginConfig(
+                module='xpublish_host.plugins.DatasetsConfigPlugin',
+                kwargs=dict(datasets_config={
+                    'simple': DatasetConfig(
+                        id='simple',
+                        title='Title',
+                        description='Description',
+                        loader=simple_loader,
+                    ),
+                }),
+            ),
+        }
+    )
+    rest, _ = setup_xpublish(config)
+    client = TestClient(rest.app)
+    assert client.post('/admin/datasets/simple/reload').status_code == 404
+
+
+@pytest.mark.parametrize('events', [True, False], ids=['watchdog', 'scan'])
+def test_watch_files(tmp_path, events, mocker):
+    if events:
+        pytest.importorskip('watchdog')
+
+    from xpublish_host.plugins.dwatch import FileWatcher
+    matches = mocker.spy(FileWatcher, 'matches')
+    scans = mocker.spy(FileWatcher, 'scan')
+
+    def noticed(name):
+        # Wait for the watcher to look at the files after `name` changed
+        if events:
+            wait_for(lambda: any(str(c.args[-1]).endswith(name) for c in matches.call_args_list))
+        else:
+            calls = scans.call_count
+            wait_for(lambda: scans.call_count >= calls + 2)
+
+    class FileLoader(SlowLoader):
+        def __call__(self, root_path, file_glob):
+            ds = super().__call__()
+            ds.attrs['files'] = len(list(root_path.glob(file_glob)))
+            return ds
+
+    (tmp_path / 'a.nc').touch()
+    (tmp_path / 'ignored.txt').touch()
+    loader = FileLoader(delay=0)
+    dc = DatasetConfig(
+        id='watched',
+        title='Title',
+        description='Description',
+        loader=loader,
+        kwargs=dict(root_path=tmp_path, file_glob='*.nc'),
+        watch_files=True,
+        watch_interval=0.1,
+        watch_events=events,
+    )
+    plugin = DatasetsConfigPlugin(datasets_config={'watched': dc})
+    assert plugin.get_dataset('watched').attrs['files'] == 1
+    watcher = plugin.file_watcher(dc)
+    # The starting scan
+    wait_for(lambda: watcher._files is not None)
+    started = watcher.last_change
+
+    # Unchanged or unrelated files don't reload the dataset
+    (tmp_path / 'ignored.txt').write_text('changed')
+    noticed('ignored.txt')
+    assert watcher.last_change == started
+    assert plugin.get_dataset('watched').attrs['load'] == 1
+
+    (tmp_path / 'b.nc').touch()
+    wait_for(lambda: watcher.last_change > started)
+    ds = plugin.get_dataset('watched')
+    assert ds.attrs['load'] == 2
+    assert ds.attrs['files'] == 2
+    assert plugin.get_dataset('watched') is ds
+
+
+def test_admin_routes_shared_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('XPUB_METRICS_DISABLE', '1')
+    loader = SlowLoader(delay=0)
+    dc = DatasetConfig(
+        id='admin',
+        title='Title',
+        description='Description',
+        loader=loader,
+    )
+    kwargs = dict(
+        datasets_config={'admin': dc},
+        admin_token='secret',
+        admin_signal_dir=tmp_path / 'signals',
+        admin_poll_interval=0,
+        shared_cache_dir=tmp_path / 'shared',
+    )
+    config = RestConfig(
+        plugins_config={
+            'dconfig': PluginConfig(
+                module='xpublish_host.plugins.DatasetsConfigPlugin',
+                kwargs=kwargs,
+            ),
+        }
+    )
+    rest, _ = setup_xpublish(config)
+    client = TestClient(rest.app)
+    plugin = rest.plugins['dconfig']
+    # Another process on the node uses the shared dataset
+    other = DatasetsConfigPlugin(**kwargs)
+    assert loader.calls == 1
+    headers = {'Authorization': 'Bearer secret'}
+
+    # An invalidated dataset is loaded again instead of read from the shared cache
+    time.sleep(0.01)
+    assert client.post('/admin/datasets/admin/invalidate', headers=headers).status_code == 202
+    assert plugin.get_dataset('admin').attrs['load'] == 2
+    # and the other process uses the new shared dataset
+    assert other.get_dataset('admin').attrs['load'] == 2
+    assert loader.calls == 2
+
+    time.sleep(0.01)
+    assert client.post('/admin/datasets/admin/reload', headers=headers).status_code == 202
+    wait_for(lambda: plugin.dataset_generation('admin') == 3)
+    assert loader.calls == 3
+    assert plugin.get_dataset('admin').attrs['load'] == 3
@@ -0,0 +1,341 @@
+import json
+import logging
+import os
+
+import dask
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from xpublish_host.loaders.cache import ChunkCache
+from xpublish_host.loaders.dataset import load_dataset_zarr
+from xpublish_host.loaders.index import FileIndex
+from xpublish_host.loaders.mfdataset import load_mfdataset
+from xpublish_host.plugins import DatasetConfig, DatasetsConfigPlugin
+
+L = logging.getLogger(__name__)
+
+
+def write_file(path, start, steps=4):
+    times = pd.date_range(start, periods=steps, freq='h')
+    ds = xr.Dataset(
+        {
+            'temp': (('time', 'y', 'x'), np.random.rand(steps, 3, 2)),
+        },
+        coords={
+            'time': times,
+            'y': [0., 1., 2.],
+            'x': [10., 20.],
+        }
+    )
+    ds.to_netcdf(path)
+    return path
+
+
+@pytest.fixture
+def archive(tmp_path):
+    root = tmp_path / 'archive'
+    root.mkdir()
+    for i in range(4):
+        write_file(root / f'file_{i:02d}.nc', pd.Timestamp('2023-01-01') + pd.Timedelta(hours=4 * i))
+    return root
+
+
+def test_load_mfdataset(archive):
+    ds = load_mfdataset(
+        archive,
+        '*.nc',
+        axes=dict(t='time', x='x', y='y'),
+        open_mfdataset_kwargs=dict(parallel=False),
+    )
+    assert ds.sizes['time'] == 16
+    assert ds.time.values[0] == np.datetime64('2023-01-01')
+
+
+def test_load_mfdataset_chunk_pattern(tmp_path):
+    for i in range(2):
+        times = pd.date_range('2023-01-01', periods=6, freq='h') + pd.Timedelta(hours=6 * i)
+        ds = xr.Dataset(
+            {
+                'temp': (('time', 'y', 'x'), np.random.rand(6, 40, 30)),
+            },
+            coords={
+                'time': times,
+                'y': np.arange(40.),
+                'x': np.arange(30.),
+            }
+        )
+        ds.to_netcdf(
+            tmp_path / f'file_{i:02d}.nc',
+            encoding={'temp': {'chunksizes': (2, 10, 15)}}
+        )
+
+    kwargs = dict(
+        root_path=tmp_path,
+        file_glob='*.nc',
+        axes=dict(t='time', x='x', y='y'),
+        open_mfdataset_kwargs=dict(parallel=False),
+    )
+    with dask.config.set({'array.chunk-size': '10KiB'}):
+        maps = load_mfdataset(chunk_pattern='map', **kwargs)
+        series = load_mfdataset(chunk_pattern='timeseries', **kwargs)
+
+    # One stored chunk in time and whole multiples of the stored x/y chunks
+    t, y, x = (c[0] for c in maps.temp.chunks)
+    assert t == 2
+    assert y % 10 == 0 and x % 15 == 0
+    assert y * x > 10 * 15
+    assert maps.temp.data.nbytes / maps.temp.data.npartitions <= 10 * 2 ** 10
+    # Every time step of each file in one stored x/y chunk
+    assert series.temp.chunks == ((6, 6), (10,) * 4, (15, 15))
+
+    with pytest.raises(ValueError):
+        load_mfdataset(chunk_pattern='sideways', **kwargs)
+
+
+def test_load_mfdataset_index(archive, tmp_path, mocker):
+    index_file = tmp_path / 'index.json'
+    kwargs = dict(
+        axes=dict(t='time', x='x', y='y'),
+        open_mfdataset_kwargs=dict(parallel=False),
+        sel=dict(time=slice('2023-01-01T08:00', None)),
+        index_file=index_file,
+    )
+
+    # Every file is opened once to index it and the same dataset is combined
+    opens = mocker.spy(xr, 'open_dataset')
+    ds = load_mfdataset(archive, '*.nc', **kwargs)
+    assert index_file.exists()
+    assert opens.call_count == 4
+    assert ds.sizes['time'] == 8
+    assert ds.time.values[0] == np.datetime64('2023-01-01T08:00')
+
+    # Indexed files that have not changed are not opened again
+    index = FileIndex(index_file)
+    assert len(index.entries) == 4
+    spy = mocker.spy(FileIndex, 'index')
+    write_file(archive / 'file_04.nc', '2023-01-01T16:00')
+    ds = load_mfdataset(archive, '*.nc', **kwargs)
+    assert spy.call_count == 1
+    assert opens.call_count == 5
+    assert ds.sizes['time'] == 12
+
+    expected = load_mfdataset(archive, '*.nc', **{ **kwargs, 'index_file': None })
+    assert ds.identical(expected)
+
+    # Changed files are indexed again
+    os.utime(archive / 'file_00.nc', (0, 0))
+    load_mfdataset(archive, '*.nc', **kwargs)
+    assert spy.call_count == 2
+
+    # Files are not skipped when selecting by index, it is applied before the selection
+    isel = dict(time=(8, 16))
+    ds = load_mfdataset(archive, '*.nc', **{ **kwargs, 'isel': isel })
+    expected = load_mfdataset(archive, '*.nc', **{ **kwargs, 'isel': isel, 'index_file': None })
+    assert ds.identical(expected)
+    assert ds.time.values[0] == np.datetime64('2023-01-01T08:00')
+
+
+def test_overlaps_partial_strings():
+    from xpublish_host.loaders.index import extent, overlaps
+
+    ext = extent(np.array(['2020-01-15', '2020-01-20'], dtype='datetime64[ns]'))
+    # Partial strings cover the whole period, like xarray
+    assert overlaps(ext, slice('2019-12', '2020-01'))
+    assert overlaps(ext, slice('2020-01-01', '2020-01-15'))
+    assert overlaps(ext, slice('2020-01-20', None))
+    assert not overlaps(ext, slice('2020-01-01', '2020-01-14'))
+    assert not overlaps(ext, slice('2020-01-21', None))
+    assert not overlaps(ext, slice(None, np.datetime64('2020-01-14T23:59')))
+
+
+def test_load_mfdataset_index_partial_strings(archive, tmp_path):
+    kwargs = dict(
+        axes=dict(t='time', x='x', y='y'),
+        open_mfdataset_kwargs=dict(parallel=False),
+        sel=dict(time=slice('2022-12', '2023-01-01')),
+    )
+    ds = load_mfdataset(archive, '*.nc', index_file=tmp_path / 'index.json', **kwargs)
+    expected = load_mfdataset(archive, '*.nc', **kwargs)
+    assert ds.sizes['time'] == 16
+    assert ds.identical(expected)
+
+
+def test_load_mfdataset_append_only(archive, mocker):
+    kwargs = dict(
+        axes=dict(t='time', x='x', y='y'),
+        open_mfdataset_kwargs=dict(parallel=False),
+        file_limit=4,
+        append_only=True,
+    )
+    full = load_mfdataset(archive, '*.nc', **kwargs)
+    assert full.sizes['time'] == 16
+
+    spy = mocker.spy(xr, 'open_dataset')
+
+    # Nothing changed, nothing is opened
+    same = load_mfdataset(archive, '*.nc', **kwargs)
+    assert spy.call_count == 0
+    assert same.identical(full)
+
+    # Only the new file is opened and the oldest file is dropped
+    write_file(archive / 'file_04.nc', '2023-01-01T16:00')
+    appended = load_mfdataset(archive, '*.nc', **kwargs)
+    assert spy.call_count == 1
+    assert spy.call_args.args[0] == archive / 'file_04.nc'
+    assert appended.sizes['time'] == 16
+    assert appended.time.values[0] == np.datetime64('2023-01-01T04:00')
+    assert appended.time.values[-1] == np.datetime64('2023-01-01T19:00')
+
+    expected = load_mfdataset(archive, '*.nc', **{ **kwargs, 'append_only': False })
+    assert appended.identical(expected)
+
+    # Changing a file that was already loaded combines everything
+    # again, but only the changed file is opened
+    spy.reset_mock()
+    os.utime(archive / 'file_02.nc', (0, 0))
+    changed = load_mfdataset(archive, '*.nc', **kwargs)
+    assert spy.call_count == 1
+    assert spy.call_args.args[0] == archive / 'file_02.nc'
+    assert changed.identical(expected)
+
+
+def test_load_mfdataset_append_only_graph(archive):
+    kwargs = dict(
+        axes=dict(t='time', x='x', y='y'),
+        open_mfdataset_kwargs=dict(parallel=False),
+        file_limit=4,
+        append_only=True,
+    )
+
+    def graph_size(ds):
+        graph = ds.temp.data.__dask_graph__()
+        return len(graph.layers), len(graph)
+
+    sizes = [ graph_size(load_mfdataset(archive, '*.nc', **kwargs)) ]
+    for i in range(4, 10):
+        write_file(archive / f'file_{i:02d}.nc', pd.Timestamp('2023-01-01') + pd.Timedelta(hours=4 * i))
+        ds = load_mfdataset(archive, '*.nc', **kwargs)
+        assert ds.time.values[-1] == np.datetime64('2023-01-01') + np.timedelta64(4 * i + 3, 'h')
+        sizes.append(graph_size(ds))
+
+    # The rolling window is rebuilt from the files instead of growing on every append
+    assert ds.sizes['time'] == 16
+    assert all(s == sizes[0] for s in sizes)
+
+
+def test_load_mfdataset_metrics(archive):
+    from prometheus_client import REGISTRY
+
+    from xpublish_host.metrics import DEFAULT_LABELS
+
+    dc = DatasetConfig(
+        id='metrics',
+        title='Title',
+        description='Description',
+        loader=load_mfdataset,
+        kwargs=dict(
+            root_path=archive,
+            file_glob='*.nc',
+            axes=dict(t='time', x='x', y='y'),
+            open_mfdataset_kwargs=dict(parallel=False),
+            append_only=True,
+        )
+    )
+    plugin = DatasetsConfigPlugin(datasets_config={'metrics': dc})
+
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(
+            f'xpublish_host_{name}',
+            dict(dataset='metrics', **labels, **DEFAULT_LABELS)
+        )
+
+    for stage in ['find_files', 'index', 'open', 'axes']:
+        assert sample('mfdataset_stage_seconds_count', stage=stage) == 1
+    assert sample('mfdataset_files_sum', files='combined') == 4
+    assert sample('mfdataset_files_sum', files='opened') == 4
+    assert sample('mfdataset_bytes_sum', files='opened') == sum(
+        f.stat().st_size for f in archive.glob('*.nc')
+    )
+
+    # Only the new file is opened when appending
+    write_file(archive / 'file_04.nc', '2023-01-01T16:00')
+    plugin.load_dataset(dc)
+    assert sample('mfdataset_stage_seconds_count', stage='open') == 2
+    assert sample('mfdataset_files_sum', files='combined') == 4 + 5
+    assert sample('mfdataset_files_sum', files='opened') == 4 + 1
+
+
+@pytest.fixture
+def references(archive, tmp_path):
+    pytest.importorskip('kerchunk')
+    pytest.importorskip('h5py')
+    from kerchunk.hdf import SingleHdf5ToZarr
+
+    path = tmp_path / 'references.json'
+    # Don't inline any data so chunks are read from the netCDF file
+    refs = SingleHdf5ToZarr(str(archive / 'file_00.nc'), inline_threshold=0).translate()
+    with open(path, 'w') as f:
+        json.dump(refs, f)
+    return path
+
+
+def test_load_dataset_zarr_cache(references, mocker):
+    from fsspec.implementations.reference import ReferenceFileSystem
+    parsed = mocker.spy(ReferenceFileSystem, '_process_references')
+
+    first = load_dataset_zarr(references)
+    second = load_dataset_zarr(references)
+    assert first.identical(second)
+    assert second.temp.values.tolist() == first.temp.values.tolist()
+    assert parsed.call_count == 1
+
+    # A changed reference file is parsed again
+    stat = references.stat()
+    os.utime(references, (stat.st_atime, stat.st_mtime + 10))
+    third = load_dataset_zarr(references)
+    assert parsed.call_count == 2
+    assert third.temp.values.tolist() == first.temp.values.tolist()
+
+
+def test_load_dataset_zarr_parquet(references, tmp_path):
+    pytest.importorskip('fastparquet')
+    from kerchunk.df import refs_to_dataframe
+
+    with open(references) as f:
+        refs = json.load(f)
+    parquet = tmp_path / 'references.parq'
+    refs_to_dataframe(refs, str(parquet))
+
+    lazy = load_dataset_zarr(parquet)
+    assert lazy.identical(load_dataset_zarr(references))
+
+
+def test_load_dataset_zarr_chunk_cache(archive, references, tmp_path):
+    cache_dir = tmp_path / 'chunks'
+    first = load_dataset_zarr(references, cache_dir=cache_dir)
+    values = first.temp.values.tolist()
+    assert list(cache_dir.glob('*/*'))
+
+    # Chunks are read from the directory once they are cached
+    for f in archive.glob('*.nc'):
+        f.unlink()
+    second = load_dataset_zarr(references, cache_dir=cache_dir, cache_memory_bytes=2 ** 20)
+    assert second.temp.values.tolist() == values
+
+
+def test_chunk_cache_eviction(tmp_path):
+    cache = ChunkCache(memory_bytes=10, directory=tmp_path, directory_bytes=100)
+    cache.set('a', b'0' * 6)
+    cache.set('b', b'1' * 6)
+    # Evicted from memory but still in the directory
+    assert list(cache._memory) == ['b']
+    assert cache.get('a') == b'0' * 6
+
+    for i in range(20):
+        cache.set(str(i), b'2' * 10)
+    cache.prune()
+    assert sum(f.stat().st_size for f in tmp_path.glob('*/*')) <= 90
+    # The most recently written chunks are kept
+    assert cache.get('19') == b'2' * 10
@@ -0,0 +1,27 @@
+import logging
+
+from starlette.requests import Request
+
+from xpublish_host.app import get_dataset_label
+from xpublish_host.metrics import parse_buckets
+
+L = logging.getLogger(__name__)
+
+
+def request(path, **scope):
+    return Request(dict(type='http', path=path, query_string=b'', headers=[], **scope))
+
+
+def test_dataset_label():
+    assert get_dataset_label(request('/datasets/sst/zarr/temp/0.0.0')) == 'sst'
+    assert get_dataset_label(request('/prefix/datasets/sst_1/data_points/filter.jsonl')) == 'sst_1'
+    assert get_dataset_label(request('/datasets')) == ''
+    assert get_dataset_label(request('/datasets/sst')) == ''
+    assert get_dataset_label(request('/health')) == ''
+
+    routed = request('/datasets/sst/zarr/.zmetadata', path_params=dict(dataset_id='routed'))
+    assert get_dataset_label(routed) == 'routed'
+
+
+def test_parse_buckets():
+    assert parse_buckets('1, 0.1,10,') == [0.1, 1.0, 10.0]
@@ -1,13 +1,24 @@
 import io
 import logging
+import time
 
+import anyio
+import dask
+import dask.array as da
+import httpx
+import numpy as np
 import pandas as pd
 import pytest
+import xarray as xr
+from fastapi.testclient import TestClient
 
-from xpublish_host.config import PluginConfig
-from xpublish_host.plugins import DatasetConfig
-
-from .utils import HostTesting, simple_loader
+from .utils import (
+    HostTesting,
+    data_points_plugins_config,
+    data_points_rest,
+    dataset_config,
+    simple_loader,
+)
 
 L = logging.getLogger(__name__)
 
@@ -33,30 +44,11 @@ class TestDataPoints(SimpleDataset):
 
     @pytest.fixture(scope='module')
     def datasets_config(self, dataset_id, loader):
-        dc = DatasetConfig(
-            id=dataset_id,
-            title='Title',
-            description='Description',
-            loader=loader,
-        )
-        yield { dataset_id: dc }
+        yield { dataset_id: dataset_config(dataset_id, loader) }
 
     @pytest.fixture(scope='module')
     def plugins_config(self, datasets_config):
-        return {
-            'zarr': PluginConfig(
-                module='xpublish.plugins.included.zarr.ZarrPlugin',
-            ),
-            'dconfig': PluginConfig(
-                module='xpublish_host.plugins.DatasetsConfigPlugin',
-                kwargs=dict(
-                    datasets_config=datasets_config
-                )
-            ),
-            'data_points': PluginConfig(
-                module='xpublish_host.plugins.DataPointsPlugin',
-            ),
-        }
+        return data_points_plugins_config(datasets_config)
 
     def test_data_points(self, dataset_id, client):
         response = client.get(
@@ -72,6 +64,39 @@ class TestDataPoints(SimpleDataset):
         assert 'count' in df
         assert (df['count'] == pd.Series([1, 2, 3])).all()
 
+    def test_data_points_jsonl(self, dataset_id, client):
+        response = client.get(
+            f'/datasets/{dataset_id}/data_points/filter.jsonl',
+            params=dict(
+                return_null=True,
+                keep='count'
+            )
+        )
+        assert response.status_code == 200
+
+        df = pd.read_json(io.StringIO(response.text), lines=True)
+        assert (df['count'] == pd.Series([1, 2, 3])).all()
+
+    @pytest.mark.parametrize('fmt', ['.arrow', '.feather'])
+    def test_data_points_arrow(self, dataset_id, client, fmt):
+        import pyarrow as pa
+        import pyarrow.feather as feather
+
+        response = client.get(
+            f'/datasets/{dataset_id}/data_points/filter{fmt}',
+            params=dict(
+                return_null=True,
+                keep='count'
+            )
+        )
+        assert response.status_code == 200
+
+        if fmt == '.arrow':
+            table = pa.ipc.open_stream(response.content).read_all()
+        else:
+            table = feather.read_table(io.BytesIO(response.content))
+        assert table.to_pandas()['count'].tolist() == [1, 2, 3]
+
     def test_scalar(self, dataset_id, client):
         response = client.get(
             f'/datasets/{dataset_id}/zarr/scalar/0',
@@ -81,3 +106,430 @@ class TestDataPoints(SimpleDataset):
             )
         )
         assert response.status_code == 200
+
+
+class TestDataPointsStreaming(TestDataPoints):
+
+    @pytest.fixture(scope='module')
+    def plugins_config(self, datasets_config):
+        # One row at a time
+        return data_points_plugins_config(datasets_config, stream_max_rows=1)
+
+    def test_parquet_row_groups(self, dataset_id, client):
+        import pyarrow.parquet as pq
+
+        response = client.get(
+            f'/datasets/{dataset_id}/data_points/filter.parquet',
+            params=dict(
+                return_null=True,
+                keep='count'
+            )
+        )
+        assert response.status_code == 200
+
+        pf = pq.ParquetFile(io.BytesIO(response.content))
+        assert pf.metadata.num_row_groups == 3
+        assert pf.read().to_pandas()['count'].tolist() == [1, 2, 3]
+
+
+def test_stream_slices_split_chunks():
+    from xpublish_host.plugins.data_points import stream_slices
+
+    ds = xr.Dataset({
+        'temp': (('time', 'y', 'x'), da.zeros((48, 100, 100), chunks=(24, 100, 100))),
+    })
+    # 10,000 rows per time step, so at most 10 time steps per slice
+    slices = list(stream_slices(ds, max_rows=100_000))
+    assert [ s.sizes['time'] for s in slices ] == [10, 10, 4, 10, 10, 4]
+    assert all(s.temp.size <= 100_000 for s in slices)
+
+
+def test_stream_writers_empty_first_slice():
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    from xpublish_host.plugins.data_points import write_arrow, write_parquet
+
+    # An empty slice has no values to infer the type of an object column from
+    frames = [
+        pd.DataFrame({ 'name': pd.Series([], dtype=object) }),
+        pd.DataFrame({ 'name': ['a', 'b'] }),
+    ]
+
+    data = b''.join(write_parquet(iter(frames)))
+    table = pq.read_table(io.BytesIO(data))
+    assert table.column('name').to_pylist() == ['a', 'b']
+
+    tables = [ pa.Table.from_pandas(df, preserve_index=False) for df in frames ]
+    data = b''.join(write_arrow(iter(tables)))
+    table = pa.ipc.open_stream(data).read_all()
+    assert table.column('name').to_pylist() == ['a', 'b']
+
+    # Only empty slices still write an empty file
+    data = b''.join(write_parquet(iter(frames[:1])))
+    assert pq.read_table(io.BytesIO(data)).num_rows == 0
+
+
+def slow_loader():
+    def slow():
+        time.sleep(1)
+        return np.arange(3)
+    return xr.Dataset({
+        'count': ('x', da.from_delayed(dask.delayed(slow)(), shape=(3,), dtype=int))
+    })
+
+
+@pytest.fixture
+def anyio_backend():
+    # The backend used by uvicorn
+    return 'asyncio'
+
+
+@pytest.mark.anyio
+async def test_data_points_off_event_loop():
+    rest = data_points_rest({ 'slow': slow_loader }, compute_threads=2)
+    assert rest.plugins['data_points'].compute_threads == 2
+
+    finished = []
+
+    async def get(url):
+        transport = httpx.ASGITransport(app=rest.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            response = await client.get(url)
+            finished.append(url)
+            return response
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(get, '/datasets/slow/data_points/filter.records')
+        await anyio.sleep(0.1)
+        tg.start_soon(get, '/datasets')
+
+    # The quick request is not blocked by the slow request
+    assert finished == ['/datasets', '/datasets/slow/data_points/filter.records']
+
+
+def test_data_points_cache():
+    computed = []
+
+    def counting_loader():
+        def count():
+            computed.append(1)
+            return np.array([1, 2, 3])
+        return xr.Dataset({
+            'count': ('x', da.from_delayed(dask.delayed(count)(), shape=(3,), dtype=int))
+        })
+
+    # Disabled by default
+    rest = data_points_rest({ 'counting': counting_loader })
+    client = TestClient(rest.app)
+    client.get('/datasets/counting/data_points/filter.records')
+    client.get('/datasets/counting/data_points/filter.records')
+    assert len(computed) == 2
+    computed.clear()
+
+    rest = data_points_rest(
+        { 'counting': counting_loader },
+        data_points_kwargs=dict(cache_max_bytes=2 ** 24),
+        cache_config=dict(available_bytes=2 ** 20),
+    )
+    client = TestClient(rest.app)
+
+    for fmt in ['.parquet', '.records']:
+        first = client.get(f'/datasets/counting/data_points/filter{fmt}')
+        second = client.get(f'/datasets/counting/data_points/filter{fmt}')
+        assert first.status_code == second.status_code == 200
+        assert first.content == second.content
+    assert len(computed) == 2
+
+    # Different parameters are not served from the cache
+    client.get('/datasets/counting/data_points/filter.parquet', params=dict(keep='count'))
+    assert len(computed) == 3
+
+    # Reloading the dataset invalidates the cached responses
+    dconfig = rest.plugins['dconfig']
+    dconfig.load_dataset(dconfig.datasets_config['counting'])
+    client.get('/datasets/counting/data_points/filter.parquet')
+    assert len(computed) == 4
+
+    # Only the keys of cached responses are tracked
+    plugin = rest.plugins['data_points']
+    cache = rest.cache
+    for i in range(20):
+        client.get('/datasets/counting/data_points/filter.records', params=dict(keep=f'v{i}'))
+    _, keys = plugin._DataPointsPlugin__cache_keys['counting']
+    assert keys
+    cache.clear()
+    client.get('/datasets/counting/data_points/filter.records', params=dict(keep='new'))
+    _, keys = plugin._DataPointsPlugin__cache_keys['counting']
+    assert len(keys) == 1
+
+
+def missing_loader():
+    return xr.Dataset({
+        'value': ('x', [1., np.nan, 3.]),
+        'time': ('x', pd.to_datetime(['2023-01-01', None, '2023-01-03'])),
+    })
+
+
+@pytest.mark.parametrize('fmt', ['.arrow', '.feather', '.parquet'])
+def test_data_points_nulls(fmt):
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    rest = data_points_rest({ 'missing': missing_loader })
+    client = TestClient(rest.app)
+    response = client.get(
+        f'/datasets/missing/data_points/filter{fmt}',
+        params=dict(return_null=True, keep='value,time'),
+    )
+    assert response.status_code == 200
+
+    if fmt == '.arrow':
+        table = pa.ipc.open_stream(response.content).read_all()
+    elif fmt == '.feather':
+        table = feather.read_table(io.BytesIO(response.content))
+    else:
+        table = pq.read_table(io.BytesIO(response.content))
+
+    # Missing values are nulls in every format
+    assert table.num_rows == 3
+    assert table.column('value').null_count == 1
+    assert table.column('time').null_count == 1
+
+
+def curvilinear_loader():
+    eta, xi = np.meshgrid(np.arange(4), np.arange(5), indexing='ij')
+    lon = -150 + xi + 0.1 * eta
+    lat = 50 + eta + 0.1 * xi
+    temp = np.arange(2 * 4 * 5).reshape(2, 4, 5)
+    return xr.Dataset(
+        {
+            'temp': (('time', 'eta', 'xi'), da.from_array(temp, chunks=(1, 2, 2))),
+        },
+        coords={
+            'time': pd.date_range('2023-01-01', periods=2, freq='h'),
+            'lon': (('eta', 'xi'), lon),
+            'lat': (('eta', 'xi'), lat),
+        }
+    )
+
+
+def test_data_points_nearest(mocker):
+    pytest.importorskip('scipy')
+
+    rest = data_points_rest(
+        { 'curvilinear': curvilinear_loader },
+    )
+    client = TestClient(rest.app)
+
+    from xpublish_host.plugins import nearest
+    built = mocker.spy(nearest.NearestIndex, '__init__')
+
+    url = '/datasets/curvilinear/data_points/filter.records'
+    params = dict(
+        time_var='time',
+        x_var='lon',
+        y_var='lat',
+        var='temp',
+        longitude='-147.2,-149.9',
+        latitude='52.3,50.1',
+    )
+    for _ in range(2):
+        response = client.get(url, params=params)
+        assert response.status_code == 200
+
+        df = pd.DataFrame(response.json())
+        assert len(df) == 4
+        first = df[df.point == 0].sort_values('t')
+        assert first.temp.tolist() == [2 * 5 + 3, 20 + 2 * 5 + 3]
+        assert first.x.iloc[0] == pytest.approx(-150 + 3 + 0.2)
+        assert first.y.iloc[0] == pytest.approx(50 + 2 + 0.3)
+        second = df[df.point == 1].sort_values('t')
+        assert second.temp.tolist() == [0, 20]
+        assert (df.distance < 30_000).all()
+
+    # The index is built once per dataset load
+    assert built.call_count == 1
+
+    response = client.get(url, params=dict(params, latitude='52.3'))
+    assert response.status_code == 400
+    response = client.get(url, params=dict(params, x_var=None))
+    assert response.status_code == 400
+
+
+def xy_grid_loader():
+    # A curvilinear grid with dimensions named like the standardized axes
+    return curvilinear_loader().rename(eta='y', xi='x')
+
+
+@pytest.mark.parametrize('fmt', ['.records', '.parquet'])
+def test_data_points_axis_named_dims(fmt):
+    import pyarrow.parquet as pq
+
+    rest = data_points_rest({ 'xy': xy_grid_loader })
+    client = TestClient(rest.app)
+    response = client.get(
+        f'/datasets/xy/data_points/filter{fmt}',
+        params=dict(time_var='time', x_var='lon', y_var='lat', var='temp'),
+    )
+    assert response.status_code == 200
+
+    if fmt == '.parquet':
+        df = pq.read_table(io.BytesIO(response.content)).to_pandas()
+    else:
+        df = pd.DataFrame(response.json())
+
+    # The x and y dimensions are replaced by the lon and lat coordinates
+    assert df.columns.is_unique
+    assert len(df) == 2 * 4 * 5
+    expected = xy_grid_loader().isel(time=0).to_dataframe().reset_index()
+    assert df.x.iloc[:20].tolist() == pytest.approx(expected.lon.tolist())
+    assert df.y.iloc[:20].tolist() == pytest.approx(expected.lat.tolist())
+
+
+def rectilinear_loader():
+    temp = np.arange(2 * 4 * 5).reshape(2, 4, 5)
+    return xr.Dataset(
+        {
+            'temp': (('time', 'lat', 'lon'), da.from_array(temp, chunks=(1, 2, 2))),
+        },
+        coords={
+            'time': pd.date_range('2023-01-01', periods=2, freq='h'),
+            'lat': np.arange(50, 54),
+            'lon': np.arange(-150, -145),
+        }
+    )
+
+
+def global_loader():
+    temp = np.arange(2 * 3 * 36).reshape(2, 3, 36)
+    return xr.Dataset(
+        {
+            'temp': (('time', 'lat', 'lon'), da.from_array(temp, chunks=(1, 3, 12))),
+        },
+        coords={
+            'time': pd.date_range('2023-01-01', periods=2, freq='h'),
+            'lat': np.array([-10, 0, 10]),
+            'lon': np.arange(-175, 180, 10),
+        }
+    )
+
+
+def test_data_points_window():
+    import pyarrow as pa
+
+    rest = data_points_rest({
+        'rectilinear': rectilinear_loader,
+        'curvilinear': curvilinear_loader,
+        'global': global_loader,
+    })
+    client = TestClient(rest.app)
+
+    def get(dataset_id, **params):
+        response = client.get(
+            f'/datasets/{dataset_id}/data_points/filter.records',
+            params=dict(time_var='time', x_var='lon', y_var='lat', var='temp', **params)
+        )
+        assert response.status_code == 200
+        return pd.DataFrame(response.json())
+
+    # Coordinate values, reversed ranges are allowed
+    df = get('rectilinear', x_start=-148.5, x_end=-146.5, y_start=52, y_end=51)
+    assert sorted(df.x.unique()) == [-148, -147]
+    assert sorted(df.y.unique()) == [51, 52]
+    assert len(df) == 8
+
+    # Indexes
+    df = get('rectilinear', x_istart=1, x_iend=3, y_istart=3)
+    assert sorted(df.x.unique()) == [-149, -148]
+    assert df.y.unique().tolist() == [53]
+    assert len(df) == 4
+
+    # Only the cells on both sides of the antimeridian
+    df = get('global', x_start=160, x_end=-160, y_start=-5, y_end=5)
+    assert sorted(df.x.unique()) == [-175, -165, 165, 175]
+    assert df.y.unique().tolist() == [0]
+    assert len(df) == 2 * 4
+
+    # Only the cells of a curvilinear grid inside the box, (eta=1, xi=2)
+    # is in the window but not inside the box
+    for fmt in ['records', 'arrow']:
+        response = client.get(
+            f'/datasets/curvilinear/data_points/filter.{fmt}',
+            params=dict(
+                time_var='time', x_var='lon', y_var='lat', var='temp',
+                x_start=-148.5, x_end=-146.5, y_start=51.3, y_end=52.5,
+            )
+        )
+        assert response.status_code == 200
+        if fmt == 'records':
+            df = pd.DataFrame(response.json())
+        else:
+            df = pa.ipc.open_stream(response.content).read_pandas()
+        assert sorted(df.temp.tolist()) == [8, 12, 13, 28, 32, 33]
+        assert sorted(df.columns) == ['t', 'temp', 'x', 'y']
+
+    # Nothing inside the box
+    df = get('rectilinear', x_start=0, x_end=10)
+    assert df.empty
+
+    response = client.get(
+        '/datasets/rectilinear/data_points/filter.records',
+        params=dict(x_start=-148)
+    )
+    assert response.status_code == 400
+
+    # Unknown spatial variables are only an error when subsetting
+    response = client.get(
+        '/datasets/rectilinear/data_points/filter.records',
+        params=dict(time_var='time', x_var='longitude', var='temp')
+    )
+    assert response.status_code == 200
+    response = client.get(
+        '/datasets/rectilinear/data_points/filter.records',
+        params=dict(time_var='time', x_var='longitude', var='temp', x_start=-148)
+    )
+    assert response.status_code == 400
+
+
+def test_data_points_timing():
+    from prometheus_client import REGISTRY
+
+    from xpublish_host.metrics import DEFAULT_LABELS
+
+    rest = data_points_rest(
+        { 'timed': curvilinear_loader },
+        data_points_kwargs=dict(server_timing=True, cache_max_bytes=2 ** 24),
+    )
+    client = TestClient(rest.app)
+
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(
+            f'xpublish_host_{name}',
+            dict(dataset='timed', **labels, **DEFAULT_LABELS)
+        )
+
+    url = '/datasets/timed/data_points/filter'
+    params = dict(time_var='time', var='temp')
+
+    response = client.get(f'{url}.records', params=params)
+    assert response.status_code == 200
+    stages = [ s.split(';')[0] for s in response.headers['Server-Timing'].split(', ') ]
+    assert stages == ['select', 'to_dataframe', 'dropna', 'serialize']
+    for stage in stages:
+        assert sample('data_points_stage_seconds_count', format='.records', stage=stage) == 1
+    assert sample('data_points_rows_sum', format='.records') == 40
+
+    # Streamed responses only have the selection timed in the header
+    response = client.get(f'{url}.arrow', params=params)
+    assert response.status_code == 200
+    assert response.headers['Server-Timing'].startswith('select;dur=')
+    for stage in ['select', 'to_table', 'serialize']:
+        assert sample('data_points_stage_seconds_count', format='.arrow', stage=stage) == 1
+    assert sample('data_points_rows_sum', format='.arrow') == 40
+
+    # Cached responses are not timed again
+    response = client.get(f'{url}.arrow', params=params)
+    assert response.headers['Server-Timing'] == 'cache;desc="hit"'
+    assert sample('data_points_rows_count', format='.arrow') == 1
@@ -8,6 +8,7 @@ from fastapi.testclient import TestClient
 
 import xpublish
 from xpublish_host.config import PluginConfig, RestConfig
+from xpublish_host.plugins import DatasetConfig
 
 
 def simple_loader(*args, **kwargs):
@@ -19,6 +20,52 @@ def simple_loader(*args, **kwargs):
     )
 
 
+def dataset_config(dataset_id, loader, **kwargs):
+    return DatasetConfig(
+        id=dataset_id,
+        title='Title',
+        description='Description',
+        loader=loader,
+        **kwargs
+    )
+
+
+def data_points_plugins_config(datasets_config, **data_points_kwargs):
+    return {
+        'zarr': PluginConfig(
+            module='xpublish.plugins.included.zarr.ZarrPlugin',
+        ),
+        'dconfig': PluginConfig(
+            module='xpublish_host.plugins.DatasetsConfigPlugin',
+            kwargs=dict(
+                datasets_config=datasets_config
+            )
+        ),
+        'data_points': PluginConfig(
+            module='xpublish_host.plugins.DataPointsPlugin',
+            kwargs=data_points_kwargs,
+        ),
+    }
+
+
+def data_points_rest(loaders, data_points_kwargs=None, **rest_kwargs):
+    """
+    A Rest app serving each loader as a dataset through the
+    DatasetsConfigPlugin and the DataPointsPlugin
+    """
+    datasets_config = {
+        k: dataset_config(k, v) for k, v in loaders.items()
+    }
+    config = RestConfig(
+        plugins_config=data_points_plugins_config(
+            datasets_config,
+            **(data_points_kwargs or {})
+        ),
+        **rest_kwargs
+    )
+    return config.setup()
+
+
 def versions_check(client):
     response = client.get('/versions')
     assert response.status_code == 200
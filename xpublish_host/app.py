@@ -7,6 +7,7 @@ from fastapi.responses import JSONResponse
 from uvicorn.workers import UvicornWorker
 
 from xpublish_host.config import RestConfig
+from xpublish_host.metrics import BUCKETS
 
 logging.basicConfig(level=logging.INFO)
 logging.getLogger('distributed').setLevel(logging.ERROR)
@@ -39,15 +40,56 @@ def setup_health(app):
     return health
 
 
+def setup_ready(app, rest):
+    """
+    A readiness endpoint reporting the load state of each dataset. It
+    returns a 503 until every dataset loaded on startup can be served.
+    """
+    if os.environ.get("XPUB_READY_DISABLE"):
+        return
+
+    ready = os.environ.get("XPUB_READY_ENDPOINT", "/ready")
+
+    def ready_check(request):
+        datasets = {}
+        for p in rest.plugins.values():
+            if hasattr(p, 'datasets_status'):
+                datasets.update(p.datasets_status())
+
+        is_ready = all(
+            d['available'] for d in datasets.values()
+            if d['required']
+        )
+        return JSONResponse(
+            {
+                'xpublish': 'ready' if is_ready else 'loading',
+                'datasets': datasets,
+            },
+            status_code=status.HTTP_200_OK if is_ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+            media_type="application/health+json",
+        )
+
+    app.add_route(ready, ready_check)
+    return ready
+
+
+DATASET_PATH = re.compile(r'/datasets/(\w+)/')
+
+
 def get_dataset_label(request):
-    try:
-        pattern = r'^.*\/datasets\/(\w+)\/.*$'
-        return re.match(pattern, str(request.url)).group(1)
-    except BaseException:
+    # Routed requests already have the dataset_id, otherwise
+    # match the path without building the full URL
+    dataset_id = request.scope.get('path_params', {}).get('dataset_id')
+    if dataset_id:
+        return dataset_id
+
+    match = DATASET_PATH.search(request.scope.get('path', ''))
+    if match is None:
         return ''
+    return match.group(1)
 
 
-def setup_metrics(app, health_endpoint):
+def setup_metrics(app, health_endpoint, ready_endpoint=None):
 
     if os.environ.get("XPUB_METRICS_DISABLE"):
         return
@@ -69,8 +111,11 @@ def setup_metrics(app, health_endpoint):
             PrometheusMiddleware,
             app_name=app_name,
             prefix=prefix_name,
-            buckets=[0.01, 0.1, 0.25, 0.5, 1.0],
-            skip_paths=[health_endpoint, metrics, '/favicon.ico'],
+            buckets=BUCKETS,
+            skip_paths=[
+                p for p in [health_endpoint, ready_endpoint, metrics, '/favicon.ico']
+                if p
+            ],
             group_paths=False,
             optional_metrics=[response_body_size, request_body_size],
             labels=dict(
@@ -128,7 +173,8 @@ def setup_xpublish(config: RestConfig = None, **setup_kwargs):
     rest = config.setup(**setup_kwargs)
     app = rest.app
     health_endpoint = setup_health(app)
-    _ = setup_metrics(app, health_endpoint)
+    ready_endpoint = setup_ready(app, rest)
+    _ = setup_metrics(app, health_endpoint, ready_endpoint)
     rest._app = app
 
     return rest, config
@@ -53,6 +53,12 @@ class RestConfig(GoodConf):
         'available_bytes': 1e11
     }
 
+    """
+    Maximum number of threads (per-process) used by plugins to do
+    blocking work (i.e. the DataPointsPlugin) outside of the event loop
+    """
+    compute_threads: PositiveInt = 4
+
     """
     {
         'processes': True,
@@ -81,6 +87,10 @@ class RestConfig(GoodConf):
             load_defaults = {}
 
         plugs = self.setup_plugins()
+        for p in plugs.values():
+            # Plugins doing blocking work default to the server wide thread limit
+            if getattr(p, 'compute_threads', False) is None:
+                p.compute_threads = self.compute_threads
 
         # Start with no datasets, they are all loaded
         # using the DatasetConfigPlugin
@@ -1,3 +1,6 @@
+import os
+import uuid
+
 from prometheus_client import multiprocess
 
 proc_name = 'xpublish'
@@ -28,6 +31,10 @@ def on_starting(server):
     scheduler address for later usage in the worker process
     init
     """
+    # Datasets shared through `shared_cache_dir` are only used by this run's workers
+    from xpublish_host.plugins.dcache import RUN_ENV
+    os.environ[RUN_ENV] = uuid.uuid4().hex
+
     from xpublish_host.app import setup_config
     config = setup_config()
     cluster = config.setup_cluster()
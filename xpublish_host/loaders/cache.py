@@ -0,0 +1,184 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+try:
+    from prometheus_client import Counter
+
+    from xpublish_host.metrics import DEFAULT_LABELS, create_metric
+    metrics = True
+    CHUNK_CACHE_READS = create_metric(
+        Counter,
+        "chunk_cache_reads",
+        "Chunks read through the chunk cache by where they were read from",
+        ["source"],
+    )
+except ImportError:
+    metrics = False
+
+L = logging.getLogger(__name__)
+
+# Chunk caches by their settings, shared by every dataset using the same settings
+_caches: dict[str, 'ChunkCache'] = {}
+_caches_lock = threading.Lock()
+
+
+def chunk_cache(
+    memory_bytes: int = 0,
+    directory: str | Path | None = None,
+    directory_bytes: int = 2 ** 30,
+) -> 'ChunkCache | None':
+    """
+    The chunk cache of these settings, or None if both the memory and
+    directory caches are disabled
+    """
+    if not memory_bytes and not directory:
+        return None
+
+    directory = str(directory) if directory else None
+    key = repr((memory_bytes, directory, directory_bytes))
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = ChunkCache(memory_bytes, directory, directory_bytes)
+        return _caches[key]
+
+
+class ChunkCache:
+    """
+    A cache of chunk bytes in memory (least recently used chunks are
+    evicted past `memory_bytes`) and, optionally, in a directory shared
+    by every worker process on a node (least recently read files are
+    removed past `directory_bytes`).
+    """
+
+    def __init__(
+        self,
+        memory_bytes: int = 0,
+        directory: str | None = None,
+        directory_bytes: int = 2 ** 30,
+    ):
+        self.memory_bytes = memory_bytes
+        self.directory = Path(directory) if directory else None
+        self.directory_bytes = directory_bytes
+
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        # Bytes this process wrote to the directory since it was last pruned
+        self._written = 0
+
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def __reduce__(self):
+        # Use the cache of the process a store is unpickled in
+        return (
+            chunk_cache,
+            (self.memory_bytes, self.directory, self.directory_bytes)
+        )
+
+    def _path(self, key: str) -> Path:
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return self.directory / name[:2] / name
+
+    def _record(self, source: str):
+        if metrics is True:
+            CHUNK_CACHE_READS.labels(source=source, **DEFAULT_LABELS).inc()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+        if data is not None:
+            self._record('memory')
+            return data
+
+        if self.directory:
+            path = self._path(key)
+            try:
+                data = path.read_bytes()
+                # Reading is what keeps a file from being removed
+                os.utime(path)
+            except FileNotFoundError:
+                data = None
+            if data is not None:
+                self._record('disk')
+                self._remember(key, data)
+                return data
+
+        self._record('remote')
+        return None
+
+    def set(self, key: str, data: bytes):
+        self._remember(key, data)
+        if self.directory:
+            self._write(key, data)
+
+    def _remember(self, key: str, data: bytes):
+        if len(data) > self.memory_bytes:
+            return
+
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_size -= len(previous)
+            self._memory[key] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+    def _write(self, key: str, data: bytes):
+        path = self._path(key)
+        try:
+            path.parent.mkdir(exist_ok=True)
+            # Write then rename so other workers never read a partial chunk
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            L.warning(f"Could not cache chunk to {path}: {e}")
+            return
+
+        with self._lock:
+            self._written += len(data)
+            # Every worker prunes after writing a tenth of the limit
+            prune = self._written > self.directory_bytes / 10
+            if prune:
+                self._written = 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """
+        Remove the least recently read files from the directory until it
+        is below 90% of `directory_bytes`
+        """
+        files = []
+        for path in self.directory.glob('*/*'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(f[1] for f in files)
+        target = self.directory_bytes * 0.9
+        if total <= self.directory_bytes:
+            return
+
+        L.info(f"Pruning chunk cache {self.directory} from {total} bytes")
+        for _, size, path in sorted(files, key=lambda f: f[0]):
+            if total <= target:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -1,12 +1,177 @@
+import hashlib
 import logging
+import threading
+from collections import defaultdict
 from pathlib import Path
 
+import fsspec
 import xarray as xr
+import zarr
+
+from xpublish_host.loaders.cache import ChunkCache, chunk_cache
 
 L = logging.getLogger(__name__)
 
+ZARR_3 = int(zarr.__version__.split('.')[0]) >= 3
+
+if ZARR_3:
+    from zarr.storage import FsspecStore as _StoreBase
+else:
+    from fsspec.mapping import FSMap as _StoreBase
+
+
+def is_metadata(key: str) -> bool:
+    return key.rsplit('/', 1)[-1].startswith('.')
+
+
+class ReferenceStore(_StoreBase):
+    """
+    A zarr store of a ReferenceFileSystem. dask tokenizes the store when the
+    dataset is opened and would otherwise pickle it, which re-parses every
+    reference in the reference file.
+
+    Chunks are read through `cache` when it is set, keyed by the token so
+    chunks are not re-used after the reference file changes.
+    """
+
+    token: str = ''
+    cache: ChunkCache | None = None
+
+    def __dask_tokenize__(self):
+        return (type(self).__name__, self.token)
+
+    def _cached(self, key: str) -> bool:
+        return self.cache is not None and not is_metadata(key)
+
+    if ZARR_3:
+        async def get(self, key, prototype, byte_range=None):
+            if byte_range is not None or not self._cached(key):
+                return await super().get(key, prototype, byte_range)
+
+            cache_key = f'{self.token}/{key}'
+            data = self.cache.get(cache_key)
+            if data is not None:
+                return prototype.buffer.from_bytes(data)
+
+            value = await super().get(key, prototype)
+            if value is not None:
+                self.cache.set(cache_key, value.to_bytes())
+            return value
+    else:
+        def __getitem__(self, key):
+            if not self._cached(key):
+                return super().__getitem__(key)
+
+            cache_key = f'{self.token}/{key}'
+            data = self.cache.get(cache_key)
+            if data is None:
+                data = super().__getitem__(key)
+                self.cache.set(cache_key, data)
+            return data
+
+        def getitems(self, keys, on_error="raise"):
+            return { k: self[k] for k in keys }
+
+
+# Parsed reference sets, re-used between loads until the reference file changes
+_references: dict[str, tuple[tuple, fsspec.AbstractFileSystem]] = {}
+_references_locks: dict[str, threading.Lock] = defaultdict(threading.Lock)
+_references_lock = threading.Lock()
 
-def load_dataset_zarr(json_path: str | Path, chunks=None):
+
+def reference_identity(fs: fsspec.AbstractFileSystem, path: str, lazy: bool) -> tuple:
+    """
+    The modification time and size of a JSON reference file, or of the
+    `.zmetadata` file of a directory of parquet references
+    """
+    if lazy:
+        path = f"{path.rstrip('/')}/.zmetadata"
+    info = fs.info(path)
+    modified = info.get('mtime') or info.get('LastModified') or info.get('created')
+    return (str(modified), info.get('size'))
+
+
+def reference_fs(
+    json_path: str | Path,
+    remote_protocol: str | None = None,
+    remote_options: dict | None = None,
+) -> tuple[fsspec.AbstractFileSystem, str]:
+    """
+    A ReferenceFileSystem of a kerchunk JSON reference file or a directory of
+    parquet (lazy) references. The parsed references are kept in memory and
+    shared by every dataset using the same file until the file changes.
+
+    Returns the filesystem and a token that changes when the file changes.
+    """
+    path = str(json_path)
+    ref_fs, ref_path = fsspec.core.url_to_fs(path)
+    lazy = ref_fs.isdir(ref_path)
+    if lazy and remote_protocol is None:
+        # Without a protocol every lazy reference is read to find one
+        remote_protocol = 'file'
+
+    key = repr((path, remote_protocol, remote_options))
+    with _references_lock:
+        lock = _references_locks[key]
+
+    # Only parse a file once when multiple datasets load it at the same time
+    with lock:
+        identity = reference_identity(ref_fs, ref_path, lazy)
+        token = hashlib.sha1(repr((key, identity)).encode('utf-8')).hexdigest()
+
+        cached = _references.get(key)
+        if cached is not None and cached[0] == identity:
+            L.info(f"Using parsed references from {path}")
+            return cached[1], token
+
+        L.info(f"Parsing references from {path}")
+        fs_kwargs = dict(
+            remote_protocol=remote_protocol,
+            remote_options=remote_options,
+        )
+        fs = fsspec.filesystem(
+            'reference',
+            fo=path,
+            skip_instance_cache=True,
+            # zarr 3 would re-create (and re-parse) a synchronous instance
+            asynchronous=ZARR_3,
+            # Unset options can't be serialized by zarr
+            **{ k: v for k, v in fs_kwargs.items() if v is not None }
+        )
+        _references[key] = (identity, fs)
+        return fs, token
+
+
+def reference_store(
+    json_path: str | Path,
+    remote_protocol: str | None = None,
+    remote_options: dict | None = None,
+    cache: ChunkCache | None = None,
+) -> ReferenceStore:
+    fs, token = reference_fs(
+        json_path,
+        remote_protocol=remote_protocol,
+        remote_options=remote_options,
+    )
+
+    if ZARR_3:
+        store = ReferenceStore(fs, path='', read_only=True)
+    else:
+        store = ReferenceStore('', fs, check=False, create=False)
+    store.token = token
+    store.cache = cache
+    return store
+
+
+def load_dataset_zarr(
+    json_path: str | Path,
+    chunks=None,
+    remote_protocol: str | None = None,
+    remote_options: dict | None = None,
+    cache_memory_bytes: int = 0,
+    cache_dir: str | Path | None = None,
+    cache_dir_bytes: int = 2 ** 30,
+):
 
     # do this to 1. use dask and 2. ensure chunks match between
     # encoding and dask arrays
@@ -17,14 +182,17 @@ def load_dataset_zarr(json_path: str | Path, chunks=None):
 
     L.info(f"using json from {json_path}")
 
+    store = reference_store(
+        json_path,
+        remote_protocol=remote_protocol,
+        remote_options=remote_options,
+        cache=chunk_cache(cache_memory_bytes, cache_dir, cache_dir_bytes),
+    )
+
     ds = xr.open_dataset(
-        "reference://", engine="zarr",
-        backend_kwargs={
-            "storage_options": {
-                "fo": json_path,
-            },
-            "consolidated": False
-        },
+        store,
+        engine="zarr",
+        consolidated=False,
         chunks=chunks,
     )
 
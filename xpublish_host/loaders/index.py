@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+import tempfile
+import typing as t
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+L = logging.getLogger(__name__)
+
+
+class FileIndex:
+    """
+    A persistent sidecar file of per-file metadata (dimensions, variable schema
+    and coordinate extents) keyed by each file's path, modification time and size.
+
+    Only files that are new or have changed since they were last indexed are
+    opened, everything else is read from the sidecar file. Without a path the
+    index is only kept in memory.
+    """
+
+    version = 1
+
+    def __init__(self, path: str | Path | None = None):
+        self.path = Path(path) if path else None
+        self.entries: dict[str, dict] = {}
+        self.changed = False
+
+        if self.path and self.path.exists():
+            try:
+                with open(self.path) as f:
+                    contents = json.load(f)
+                if contents.get('version') == self.version:
+                    self.entries = contents.get('files', {})
+            except BaseException as e:
+                L.warning(f"Could not read the file index {self.path}, rebuilding: {e}")
+
+    @staticmethod
+    def key(path: str | Path) -> str:
+        return str(Path(path).absolute())
+
+    def get(self, path: str | Path) -> dict | None:
+        """
+        Return the indexed metadata of a file if it has not changed since
+        it was indexed
+        """
+        entry = self.entries.get(self.key(path))
+        if entry is None:
+            return None
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        if entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+            return None
+
+        return entry
+
+    def refresh(
+        self,
+        files: list[Path],
+        open_kwargs: dict,
+        axes: list[str],
+        open_files: t.Callable[[list[Path]], dict] | None = None,
+    ) -> dict[Path, dict]:
+        """
+        Return the metadata of each file, opening only files that are not
+        indexed or have changed since they were indexed.
+
+        If defined, `open_files` is called with the files that need to be indexed
+        and returns their opened datasets (or the error opening them) by file, so
+        files that are indexed and then combined are only opened once.
+        """
+        indexed = { f: self.get(f) for f in files }
+        stale = [ f for f, entry in indexed.items() if entry is None ]
+        opened = open_files(stale) if open_files is not None and stale else {}
+        for f in stale:
+            entry = self.index(f, open_kwargs, axes, dataset=opened.get(f))
+            self.entries[self.key(f)] = entry
+            self.changed = True
+            indexed[f] = entry
+
+        # Forget about files that are no longer being used
+        keys = { self.key(f) for f in files }
+        for k in list(self.entries.keys()):
+            if k not in keys:
+                del self.entries[k]
+                self.changed = True
+
+        return indexed
+
+    @staticmethod
+    def index(
+        path: Path,
+        open_kwargs: dict,
+        axes: list[str],
+        dataset: xr.Dataset | BaseException | None = None,
+    ) -> dict:
+        """
+        Index a file, describing `dataset` if the file was already opened
+        """
+        stat = os.stat(path)
+        entry = dict(
+            mtime=stat.st_mtime,
+            size=stat.st_size,
+            dims={},
+            variables={},
+            extents={},
+            error=None,
+        )
+
+        try:
+            if isinstance(dataset, BaseException):
+                raise dataset
+            elif dataset is not None:
+                entry.update(describe(dataset, axes))
+            else:
+                with xr.open_dataset(path, **open_kwargs) as ds:
+                    entry.update(describe(ds, axes))
+        except BaseException as e:
+            L.warning(f"Could not index {path}: {e}")
+            entry['error'] = str(e)
+
+        return entry
+
+    def save(self):
+        if not self.changed or self.path is None:
+            return
+
+        contents = dict(
+            version=self.version,
+            files=self.entries,
+        )
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                'wt',
+                dir=self.path.parent,
+                prefix=f'.{self.path.name}.',
+                delete=False
+            ) as f:
+                json.dump(contents, f)
+            os.replace(f.name, self.path)
+            self.changed = False
+        except BaseException as e:
+            L.warning(f"Could not save the file index {self.path}: {e}")
+
+
+def describe(ds: xr.Dataset, axes: list[str]) -> dict[str, t.Any]:
+    """
+    The dimensions, variable schema and extents of the `axes` of a dataset
+    """
+    return dict(
+        dims={ str(k): int(v) for k, v in ds.sizes.items() },
+        variables={
+            str(k): dict(
+                dims=[ str(d) for d in v.dims ],
+                dtype=str(v.dtype),
+            )
+            for k, v in ds.variables.items()
+        },
+        extents={
+            a: extent(ds[a].values)
+            for a in axes
+            if a in ds.variables and ds[a].ndim == 1 and ds[a].size
+        },
+    )
+
+
+def extent(values: np.ndarray) -> dict[str, t.Any]:
+    kind = values.dtype.kind
+    if kind == 'M':
+        lo, hi = values.min(), values.max()
+        return dict(kind=kind, min=str(lo), max=str(hi), size=int(values.size))
+    elif kind in 'iuf':
+        lo, hi = values.min(), values.max()
+        return dict(kind=kind, min=float(lo), max=float(hi), size=int(values.size))
+    # Extents of other types (cftime, strings) can't be compared
+    return dict(kind=kind, min=None, max=None, size=int(values.size))
+
+
+def overlaps(ext: dict[str, t.Any], selection: slice) -> bool:
+    """
+    Return False only if the extent is known to fall completely
+    outside of the selection
+    """
+    if ext.get('min') is None or ext.get('max') is None:
+        return True
+
+    if ext['kind'] == 'M':
+        def convert(v):
+            """
+            The first and last time a bound covers. Like xarray, a partial
+            date string covers the whole period, i.e. '2020-01' is all of January.
+            """
+            ts = pd.Timestamp(v)
+            if ts.tzinfo is not None:
+                ts = ts.tz_convert('UTC').tz_localize(None)
+            elif isinstance(v, str):
+                period = pd.Period(v)
+                first = np.datetime64(period.start_time, 'ns')
+                after = np.datetime64((period + 1).start_time, 'ns')
+                return first, after - np.timedelta64(1, 'ns')
+            ts = np.datetime64(ts, 'ns')
+            return ts, ts
+    else:
+        def convert(v):
+            return float(v), float(v)
+
+    try:
+        lo, _ = convert(ext['min'])
+        hi, _ = convert(ext['max'])
+        start, stop = selection.start, selection.stop
+        start = convert(start) if start is not None else None
+        stop = convert(stop) if stop is not None else None
+        # Slices of descending coordinates are reversed
+        if start is not None and stop is not None and start[0] > stop[0]:
+            start, stop = stop, start
+        if start is not None and hi < start[0]:
+            return False
+        if stop is not None and lo > stop[1]:
+            return False
+    except BaseException as e:
+        L.warning(f"Could not compare {selection} to indexed extents: {e}")
+
+    return True
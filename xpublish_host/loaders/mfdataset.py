@@ -1,12 +1,123 @@
 import logging
+import math
+import os
+import threading
+import time
 import typing as t
+from contextlib import contextmanager
 from operator import attrgetter
 from pathlib import Path
 
+import dask
+import dask.array as da
 import xarray as xr
 
+from xpublish_host.loaders.index import FileIndex, overlaps
+from xpublish_host.metrics import DATASET_LABEL
+
+try:
+    from prometheus_client import Histogram
+
+    from xpublish_host.metrics import DEFAULT_LABELS, create_metric
+    metrics = True
+    MFDATASET_STAGE_TIME = create_metric(
+        Histogram,
+        "mfdataset_stage_seconds",
+        "How long each stage of load_mfdataset took",
+        ["dataset", "stage"],
+        buckets=[0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300],
+    )
+    MFDATASET_FILES = create_metric(
+        Histogram,
+        "mfdataset_files",
+        "How many files load_mfdataset combined and opened",
+        ["dataset", "files"],
+        buckets=[1, 10, 100, 1_000, 10_000, 100_000],
+    )
+    MFDATASET_BYTES = create_metric(
+        Histogram,
+        "mfdataset_bytes",
+        "The size of the files load_mfdataset combined and opened",
+        ["dataset", "files"],
+        buckets=[2 ** 20, 2 ** 24, 2 ** 28, 2 ** 32, 2 ** 36, 2 ** 40],
+    )
+except ImportError:
+    metrics = False
+
 L = logging.getLogger(__name__)
 
+# Keyword arguments of xarray.open_mfdataset that also control how
+# each individual file is opened
+OPEN_DATASET_KWARGS = [
+    'engine',
+    'decode_cf',
+    'decode_times',
+    'decode_timedelta',
+    'drop_variables',
+    'mask_and_scale',
+    'use_cftime',
+]
+
+# Keyword arguments of xarray.open_mfdataset that control how the
+# opened files are combined
+COMBINE_KWARGS = [
+    'combine',
+    'concat_dim',
+    'compat',
+    'data_vars',
+    'coords',
+    'join',
+    'combine_attrs',
+    'attrs_file',
+    'preprocess',
+    'parallel',
+    'errors',
+]
+
+# The state of datasets loaded with index_file or append_only, kept between reloads
+_load_state: dict[str, dict] = {}
+_load_lock = threading.Lock()
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    Record how long a stage of loading a dataset took, labeled
+    with the dataset being loaded
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        L.debug(f"Stage {stage} took {elapsed:.3f}s")
+        if metrics is True:
+            MFDATASET_STAGE_TIME.labels(
+                dataset=DATASET_LABEL.get(),
+                stage=stage,
+                **DEFAULT_LABELS
+            ).observe(elapsed)
+
+
+def record_files(kind: str, files: list[Path]):
+    """
+    Record the number and total size of the files that were combined
+    into a dataset or opened to load it
+    """
+    if metrics is not True:
+        return
+
+    size = 0
+    for f in files:
+        try:
+            size += os.stat(f).st_size
+        except OSError:
+            pass
+
+    labels = dict(dataset=DATASET_LABEL.get(), files=kind, **DEFAULT_LABELS)
+    MFDATASET_FILES.labels(**labels).observe(len(files))
+    MFDATASET_BYTES.labels(**labels).observe(size)
+
 
 def load_mfdataset(
     root_path: str | Path,
@@ -17,6 +128,7 @@ def load_mfdataset(
     skip_tail_files: int | None = 0,
     computes: list[str] | None = None,
     chunks: dict[str, int] | None = None,
+    chunk_pattern: str | None = None,
     axes: dict[str, str] | None = None,
     sort_by: dict[str, str] | None = None,
     isel: dict[str, slice] | None = None,
@@ -24,10 +136,13 @@ def load_mfdataset(
     rechunk: bool = False,
     attrs_file_idx: int = -1,
     combine_by_coords: list[str | Path] = None,
+    index_file: str | Path | None = None,
+    append_only: bool = False,
     **kwargs
 ) -> xr.Dataset:
 
     # drops = drops or []
+    open_mfdataset_kwargs = dict(open_mfdataset_kwargs)
     computes = computes or []
     chunks = chunks or {}
     axes = axes or {}
@@ -36,36 +151,26 @@ def load_mfdataset(
     sel = sel or {}
     combine_by_coords = combine_by_coords or []
 
-    root = Path(root_path)
-    files = sorted(
-        [
-            p for p in root.glob(file_glob)
-        ],
-        key=attrgetter('name')
-    )
-
-    # Skip files from the front and back. If not defined
-    # (None) this won't change the files list.
-    if skip_tail_files:
-        skip_tail_files = skip_tail_files * -1
-    else:
-        # Prevents a zero from not working as expected
-        skip_tail_files = None
-
-    files = files[skip_head_files:skip_tail_files]
-
-    # You know, for testing
-    if file_limit:
-        files = files[-file_limit:]
-
-    num_files = len(files)
-    L.info(f"Found {num_files} files in {root_path}{file_glob}")
-    if not num_files:
-        return xr.Dataset()
+    with timed('find_files'):
+        files = find_files(
+            root_path,
+            file_glob,
+            file_limit=file_limit,
+            skip_head_files=skip_head_files,
+            skip_tail_files=skip_tail_files,
+        )
 
-    # Set a default chunking scheme if one was not provided
-    # that uses all defined axes chunked by 'auto'
+    # Set a default chunking scheme if one was not provided that is aligned
+    # with the chunks in the files or uses all defined axes chunked by 'auto'
     axis_names = ['t', 'z', 'x', 'y']
+    if not chunks and chunk_pattern and files:
+        with timed('chunks'):
+            chunks = aligned_chunks(
+                files[attrs_file_idx],
+                axes,
+                chunk_pattern,
+                engine=open_mfdataset_kwargs.get('engine', 'netcdf4'),
+            )
     if not chunks:
         chunks = {
             axes.get(a, a): 'auto'
@@ -74,9 +179,6 @@ def load_mfdataset(
         }
     L.info(f'Using chunking scheme: {chunks}')
 
-    # Pull metadata from the last file unless a file was specified
-    attrs_file = open_mfdataset_kwargs.pop('attrs_file', files[attrs_file_idx])
-
     # These are the default open_mfdataset_kwargs
     xr_kwargs = dict(
         parallel=True,
@@ -92,61 +194,387 @@ def load_mfdataset(
         decode_times=True,
         decode_timedelta=False,
         chunks=chunks,
-        attrs_file=attrs_file,
     )
+    attrs_file = open_mfdataset_kwargs.pop('attrs_file', None)
     xr_kwargs.update(open_mfdataset_kwargs)
 
-    L.info(f"Loading {num_files} files with {xr_kwargs}...")
+    # Datasets loaded with index_file or append_only keep their state between reloads
+    state_key = repr((str(root_path), file_glob, xr_kwargs, attrs_file, attrs_file_idx))
+    state = {}
+    if index_file or append_only:
+        with _load_lock:
+            state = _load_state.setdefault(state_key, {})
+
+    index = None
+    datasets = None
+    if (index_file or append_only) and files:
+        index = state.get('index') or FileIndex(index_file)
+        state['index'] = index
+        datasets = state.get('datasets') or FileDatasets(xr_kwargs)
+        state['datasets'] = datasets
+        # isel is applied to the combined files before sel, so removing
+        # files outside of the sel slice would change what isel selects
+        prune = sel if not isel else {}
+        with timed('index'):
+            files = filter_indexed_files(files, index, xr_kwargs, axes, prune, datasets.open)
+
+    num_files = len(files)
+    L.info(f"Found {num_files} files in {root_path}{file_glob}")
+    if not num_files:
+        if datasets is not None:
+            datasets.finish()
+        return xr.Dataset()
+
+    # Pull metadata from the last file unless a file was specified
+    xr_kwargs['attrs_file'] = attrs_file or files[attrs_file_idx]
+
     cache_size = max(num_files, 128)
     xr.set_options(file_cache_maxsize=cache_size)
-    ds = xr.open_mfdataset(
-        files,
-        **xr_kwargs
-    )
+    with timed('open'):
+        if append_only:
+            # Keep the dataset of every file, they are combined again when the files change
+            datasets.open(files)
+            ds = append_files(state, files, datasets, xr_kwargs)
+        elif datasets is not None:
+            L.info(f"Combining {num_files} files with {xr_kwargs}...")
+            ds = datasets.combine(files, xr_kwargs)
+        else:
+            L.info(f"Loading {num_files} files with {xr_kwargs}...")
+            ds = xr.open_mfdataset(
+                files,
+                **xr_kwargs
+            )
+    opened = files
+    if datasets is not None:
+        opened = datasets.finish()
+    record_files('combined', files)
+    record_files('opened', opened)
 
     if combine_by_coords:
-        for combine_file in combine_by_coords:
-            L.info(f"Combining {combine_file}...")
-            combo = xr.open_dataset(
-                combine_file,
-                engine='netcdf4',
-                drop_variables=xr_kwargs.get('drop_variables', [])
-            )
-            ds = xr.combine_by_coords(
-                [combo, ds],
-                compat='override',
-                combine_attrs='override'
-            )
+        with timed('combine_by_coords'):
+            for combine_file in combine_by_coords:
+                L.info(f"Combining {combine_file}...")
+                combo = xr.open_dataset(
+                    combine_file,
+                    engine='netcdf4',
+                    drop_variables=xr_kwargs.get('drop_variables', [])
+                )
+                ds = xr.combine_by_coords(
+                    [combo, ds],
+                    compat='override',
+                    combine_attrs='override'
+                )
 
     if sort_by:
         L.info(f"Sorting by {sort_by}...")
-        ds = ds.sortby(sort_by)
+        with timed('sort_by'):
+            ds = ds.sortby(sort_by)
 
     if isel:
         L.info("Selecting by index...")
         isels = {
             k: slice(*v) for k, v in isel.items()
         }
-        ds = ds.isel(**isels)
+        with timed('isel'):
+            ds = ds.isel(**isels)
 
     if sel:
         L.info("Selecting...")
-        ds = ds.sel(**sel)
+        with timed('sel'):
+            ds = ds.sel(**sel)
 
     if rechunk is True and chunks:
         L.info("Rechunking...")
         # Remove any dims that may have been squashed due to processing
         chunks = { k: v for k, v in chunks.items() if k in ds.dims }
-        ds = ds.chunk(chunks)
+        with timed('rechunk'):
+            ds = ds.chunk(chunks)
 
     L.info("Computing and assigning axes as coordinates...")
-    assigns = {}
-    for _, aname in axes.items():
-        assigns[aname] = ds[aname].compute()
-    ds = ds.assign_coords(assigns)
+    with timed('axes'):
+        assigns = {}
+        for _, aname in axes.items():
+            assigns[aname] = ds[aname].compute()
+        ds = ds.assign_coords(assigns)
 
     L.info("Computing variables...")
-    for variable in computes:
-        ds[variable] = ds[variable].compute()
+    with timed('computes'):
+        for variable in computes:
+            ds[variable] = ds[variable].compute()
+
+    return ds
+
+
+def aligned_chunks(
+    path: str | Path,
+    axes: dict[str, str],
+    pattern: str,
+    engine: str = 'netcdf4',
+) -> dict[str, int]:
+    """
+    Dask chunks that are whole multiples of the chunks the data variables
+    of a file are stored in, shaped for an access `pattern`:
+
+    * `map` - one stored chunk along the time axis and as much of the
+      other axes as fits in dask's `array.chunk-size`
+    * `timeseries` - one stored chunk along the other axes and as many
+      time steps as fit in dask's `array.chunk-size`
+    """
+    if pattern not in ('map', 'timeseries'):
+        raise ValueError(f"Unknown chunk_pattern {pattern}, use 'map' or 'timeseries'")
+
+    time_dim = axes.get('t', 't')
+    dims = [ axes.get(a, a) for a in ['t', 'z', 'x', 'y'] if a in axes ]
+    limit = dask.utils.parse_bytes(dask.config.get('array.chunk-size'))
+
+    with xr.open_dataset(path, engine=engine, decode_cf=False) as ds:
+        variables = [
+            v for v in ds.data_vars.values()
+            if time_dim in v.dims and any(d in dims for d in v.dims if d != time_dim)
+        ]
+        if not variables:
+            return {}
 
+        # Chunks along each dimension that are multiples of every variable's chunks
+        stored = {}
+        for v in variables:
+            sizes = v.encoding.get('chunksizes') or v.shape
+            for d, size in zip(v.dims, sizes):
+                stored[d] = min(math.lcm(stored.get(d, 1), size), ds.sizes[d])
+
+        largest = max(variables, key=lambda v: v.nbytes)
+        previous = tuple(stored[d] for d in largest.dims)
+        if pattern == 'map':
+            wanted = tuple(
+                stored[d] if d == time_dim else 'auto'
+                for d in largest.dims
+            )
+        else:
+            wanted = tuple(
+                'auto' if d == time_dim else stored[d]
+                for d in largest.dims
+            )
+        normalized = da.core.normalize_chunks(
+            wanted,
+            largest.shape,
+            limit=limit,
+            dtype=largest.dtype,
+            previous_chunks=previous,
+        )
+
+    chunks = {
+        d: c[0]
+        for d, c in zip(largest.dims, normalized)
+        if d in dims
+    }
+    L.info(f"Chunks aligned with the {pattern} pattern of {path}: {chunks}")
+    return chunks
+
+
+def find_files(
+    root_path: str | Path,
+    file_glob: str,
+    file_limit: int | None = None,
+    skip_head_files: int | None = 0,
+    skip_tail_files: int | None = 0,
+) -> list[Path]:
+    root = Path(root_path)
+    files = sorted(
+        [
+            p for p in root.glob(file_glob)
+        ],
+        key=attrgetter('name')
+    )
+
+    # Skip files from the front and back. If not defined
+    # (None) this won't change the files list.
+    if skip_tail_files:
+        skip_tail_files = skip_tail_files * -1
+    else:
+        # Prevents a zero from not working as expected
+        skip_tail_files = None
+
+    files = files[skip_head_files:skip_tail_files]
+
+    # You know, for testing
+    if file_limit:
+        files = files[-file_limit:]
+
+    return files
+
+
+def filter_indexed_files(
+    files: list[Path],
+    index: FileIndex,
+    xr_kwargs: dict,
+    axes: dict[str, str],
+    sel: dict[str, t.Any],
+    open_files: t.Callable[[list[Path]], dict] | None = None,
+) -> list[Path]:
+    """
+    Use an index of per-file metadata to remove files that can't be
+    combined or fall completely outside of a `sel` slice along the concat
+    dimension, without opening any files that were already indexed.
+    """
+    open_kwargs = { k: v for k, v in xr_kwargs.items() if k in OPEN_DATASET_KWARGS }
+    indexed = index.refresh(files, open_kwargs, list(axes.values()), open_files)
+    index.save()
+
+    concat_dims = xr_kwargs.get('concat_dim') or []
+    if isinstance(concat_dims, str):
+        concat_dims = [concat_dims]
+
+    keep = []
+    for f in files:
+        entry = indexed[f]
+
+        if entry['error']:
+            L.warning(f"Skipping {f}, it could not be opened: {entry['error']}")
+            continue
+
+        missing = [ d for d in concat_dims if d and d not in entry['dims'] ]
+        if missing:
+            L.warning(f"Skipping {f}, it is missing the dimensions {missing}")
+            continue
+
+        outside = [
+            k for k, v in sel.items()
+            if isinstance(v, slice) and k in entry['extents'] and not overlaps(entry['extents'][k], v)
+        ]
+        if outside:
+            L.debug(f"Skipping {f}, it is outside of the selection along {outside}")
+            continue
+
+        keep.append(f)
+
+    L.info(f"Using {len(keep)} of {len(files)} indexed files")
+    return keep
+
+
+def append_files(
+    state: dict,
+    files: list[Path],
+    datasets: 'FileDatasets',
+    xr_kwargs: dict,
+) -> xr.Dataset:
+    """
+    Combine the datasets of the files, which are only opened when they are added
+    to the file list. Files dropped from the head of the file list are left out
+    and the previous dataset is used as is if the file list has not changed.
+
+    The dataset is rebuilt from the dataset of each file instead of concatenating
+    new files onto the previous dataset, so its task graph doesn't grow with
+    every reload.
+    """
+    current = [ file_identity(f) for f in files ]
+    previous = state.get('files')
+    if current == previous:
+        return state['dataset']
+
+    if previous:
+        kept = set(previous) & set(current)
+        L.info(
+            f"Appending {len(current) - len(kept)} files and "
+            f"dropping {len(previous) - len(kept)} files..."
+        )
+    else:
+        L.info(f"Combining {len(files)} files with {xr_kwargs}...")
+
+    ds = datasets.combine(files, xr_kwargs)
+    state['files'] = current
+    state['dataset'] = ds
     return ds
+
+
+def file_identity(path: Path) -> tuple[str, float, int]:
+    stat = os.stat(path)
+    return (str(Path(path).absolute()), stat.st_mtime, stat.st_size)
+
+
+class FileDatasets:
+    """
+    The dataset of each file, opened the same way `xarray.open_mfdataset`
+    opens them and kept between loads until the file's path, modification
+    time or size changes, so reloads only open new or changed files.
+    """
+
+    def __init__(self, xr_kwargs: dict):
+        self.open_kwargs = { k: v for k, v in xr_kwargs.items() if k not in COMBINE_KWARGS }
+        self.open_kwargs['chunks'] = self.open_kwargs.get('chunks') or {}
+        self.preprocess = xr_kwargs.get('preprocess')
+        self.parallel = xr_kwargs.get('parallel', False)
+
+        self.datasets: dict[tuple, xr.Dataset | BaseException] = {}
+        # The datasets used and the files opened by the current load
+        self.used: dict[tuple, xr.Dataset | BaseException] = {}
+        self.opened: list[Path] = []
+
+    def open_file(self, path: Path) -> xr.Dataset | BaseException:
+        try:
+            ds = xr.open_dataset(path, **self.open_kwargs)
+            if self.preprocess is not None:
+                ds = self.preprocess(ds)
+            return ds
+        except Exception as e:
+            return e
+
+    def open(self, files: list[Path]) -> dict[Path, xr.Dataset | BaseException]:
+        """
+        Return the dataset of each file (or the error opening it), opening
+        only files that were not opened before or have changed since
+        """
+        keys = { f: file_identity(f) for f in files }
+        new_files = [ f for f in files if keys[f] not in self.datasets ]
+        if new_files:
+            if self.parallel:
+                opened = dask.compute(*[ dask.delayed(self.open_file)(f) for f in new_files ])
+            else:
+                opened = [ self.open_file(f) for f in new_files ]
+            for f, ds in zip(new_files, opened):
+                self.datasets[keys[f]] = ds
+            self.opened += new_files
+
+        result = {}
+        for f in files:
+            result[f] = self.used[keys[f]] = self.datasets[keys[f]]
+        return result
+
+    def combine(self, files: list[Path], xr_kwargs: dict) -> xr.Dataset:
+        """
+        Combine the datasets of files the same way `xarray.open_mfdataset`
+        combines the files it opens
+        """
+        opened = self.open(files)
+        for ds in opened.values():
+            if isinstance(ds, BaseException):
+                raise ds
+        datasets = [ opened[f] for f in files ]
+
+        kwargs = {
+            k: xr_kwargs[k]
+            for k in ['compat', 'data_vars', 'coords', 'join', 'combine_attrs']
+            if k in xr_kwargs
+        }
+        kwargs.setdefault('combine_attrs', 'override')
+        if xr_kwargs.get('combine', 'by_coords') == 'nested':
+            ds = xr.combine_nested(datasets, concat_dim=xr_kwargs.get('concat_dim'), **kwargs)
+        else:
+            ds = xr.combine_by_coords(datasets, **kwargs)
+
+        attrs_file = xr_kwargs.get('attrs_file')
+        paths = [ Path(f) for f in files ]
+        if attrs_file is not None and Path(attrs_file) in paths:
+            ds.attrs = dict(datasets[paths.index(Path(attrs_file))].attrs)
+        return ds
+
+    def finish(self) -> list[Path]:
+        """
+        Forget the datasets of files that were not used by the current load
+
+        Returns the files that were opened by the current load.
+        """
+        opened = self.opened
+        self.datasets = self.used
+        self.used = {}
+        self.opened = []
+        return opened
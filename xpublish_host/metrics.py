@@ -1,4 +1,5 @@
 import os
+from contextvars import ContextVar
 
 APP_NAME = os.environ.get("XPUB_METRICS_APP_NAME", "xpublish")
 PREFIX_NAME = os.environ.get("XPUB_METRICS_PREFIX_NAME", "xpublish_host")
@@ -10,6 +11,20 @@ DEFAULT_LABELS = {
 }
 
 
+def parse_buckets(value: str) -> list[float]:
+    """
+    Parse a comma-separated list of histogram bucket upper bounds
+    """
+    return sorted(float(b) for b in value.split(',') if b.strip())
+
+
+# Request latency histogram buckets (seconds) of the metrics middleware
+BUCKETS = parse_buckets(os.environ.get("XPUB_METRICS_BUCKETS", "0.01,0.1,0.25,0.5,1.0"))
+
+# The id of the dataset being loaded, used to label metrics recorded by loaders
+DATASET_LABEL: ContextVar[str] = ContextVar('dataset_label', default='')
+
+
 def create_metric(metric_type, name, description, labels, *args, **kwargs):
     labels += list(DEFAULT_LABELS.keys())
     return metric_type(
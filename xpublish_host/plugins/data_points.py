@@ -1,26 +1,73 @@
 import io
+import json
 import logging
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timezone
 from enum import Enum
-from typing import Annotated, Sequence
+from typing import (
+    Annotated,
+    Iterator,
+    Sequence,
+)
 
+import anyio
+import numpy as np
+import pandas as pd
+import xarray as xr
 from fastapi import (
     APIRouter,
     Depends,
+    HTTPException,
     Query,
+    Request,
     Response,
 )
 from fastapi.responses import StreamingResponse
+from pydantic import PrivateAttr
 
 from xpublish.plugins import (
     Dependencies,
     Plugin,
     hookimpl,
 )
+from xpublish_host.plugins.nearest import NearestIndex
 from xpublish_host.utils import CommaSeparatedList
 
+try:
+    from prometheus_client import Histogram
+
+    from xpublish_host.metrics import DEFAULT_LABELS, create_metric
+    metrics = True
+    DATA_POINTS_STAGE_TIME = create_metric(
+        Histogram,
+        "data_points_stage_seconds",
+        "How long each stage of building a data_points response took",
+        ["dataset", "format", "stage"],
+        buckets=[0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30],
+    )
+    DATA_POINTS_ROWS = create_metric(
+        Histogram,
+        "data_points_rows",
+        "How many rows a data_points response contained",
+        ["dataset", "format"],
+        buckets=[1, 10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000],
+    )
+except ImportError:
+    metrics = False
+
 L = logging.getLogger(__name__)
 
+DEFAULT_COMPUTE_THREADS = 4
+# How often to check if a client disconnected while waiting on a response
+DISCONNECT_POLL_INTERVAL = 0.25
+# Non-standard (nginx) status code for requests the client gave up on
+CLIENT_CLOSED_REQUEST = 499
+# Coordinate marking the cells of a spatial window that are inside the
+# requested box, rows of the other cells are removed
+INSIDE_VAR = '__data_points_inside__'
+
 
 def utc_native_dt(dt):
     if isinstance(dt, datetime):
@@ -38,6 +85,333 @@ class DataFormat(str, Enum):
     RECORDS = '.records'
     INDEX = '.index'
     PARQUET = '.parquet'
+    ARROW = '.arrow'
+    FEATHER = '.feather'
+
+
+class StreamSink(io.RawIOBase):
+    """
+    A write-only file-like object that keeps track of the position in the
+    stream while handing off everything written to it through `drain`
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.buffer += b
+        self.position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def within(values: xr.DataArray, start: float | None, end: float | None, wrap: bool = False) -> xr.DataArray:
+    """
+    Which values are between start and end (inclusive). With `wrap` a start
+    greater than the end is a range crossing the antimeridian, otherwise
+    the range is reversed.
+    """
+    if start is not None and end is not None and start > end:
+        if wrap:
+            return (values >= start) | (values <= end)
+        start, end = end, start
+
+    inside = xr.ones_like(values, dtype=bool)
+    if start is not None:
+        inside &= values >= start
+    if end is not None:
+        inside &= values <= end
+    return inside
+
+
+def grid_window(mask: xr.DataArray) -> dict[str, slice | np.ndarray]:
+    """
+    Indexers of the grid cells where the mask is True. A grid with more than
+    one dimension is reduced to the smallest window containing every cell so
+    a dask backed dataset only reads the chunks that overlap the window. Cells
+    of an unstructured grid are selected individually unless they are contiguous.
+    """
+    mask = mask.reset_coords(drop=True)
+    values = np.asarray(mask.values, dtype=bool)
+
+    if values.ndim == 1:
+        cells = np.flatnonzero(values)
+        if not cells.size:
+            return { mask.dims[0]: slice(0, 0) }
+        elif cells[-1] - cells[0] + 1 == cells.size:
+            return { mask.dims[0]: slice(int(cells[0]), int(cells[-1]) + 1) }
+        return { mask.dims[0]: cells }
+
+    indexers = {}
+    for i, dim in enumerate(mask.dims):
+        others = tuple(a for a in range(values.ndim) if a != i)
+        cells = np.flatnonzero(values.any(axis=others))
+        if not cells.size:
+            indexers[dim] = slice(0, 0)
+        else:
+            indexers[dim] = slice(int(cells[0]), int(cells[-1]) + 1)
+    return indexers
+
+
+def stream_slices(ds: xr.Dataset, max_rows: int) -> Iterator[xr.Dataset]:
+    """
+    Split a dataset along its first dimension into slices that each convert
+    to a dataframe of at most `max_rows` rows (but always at least one step of
+    the first dimension). Slices are aligned to dask chunks when the dataset
+    is chunked along that dimension, chunks larger than a slice are split.
+    """
+    if not ds.dims or 0 in ds.sizes.values():
+        yield ds
+        return
+
+    dim = list(ds.dims)[0]
+    step_rows = max(int(np.prod([ v for k, v in ds.sizes.items() if k != dim ])), 1)
+    max_steps = max(max_rows // step_rows, 1)
+
+    chunks = ds.chunks.get(dim) if ds.chunks else None
+    if chunks:
+        edges = [0]
+        for size in chunks:
+            chunk_start = edges[-1]
+            edges += list(range(chunk_start + max_steps, chunk_start + size, max_steps))
+            edges.append(chunk_start + size)
+    else:
+        edges = list(range(0, ds.sizes[dim] + 1))
+
+    start = end = 0
+    for edge in edges[1:]:
+        if edge - start > max_steps and end > start:
+            yield ds.isel({ dim: slice(start, end) })
+            start = end
+        end = edge
+
+    if end > start:
+        yield ds.isel({ dim: slice(start, end) })
+
+
+def dataset_to_arrow(
+    ds: xr.Dataset,
+    columns: dict[str, str],
+    null_subset: list[str] | None = None,
+    mask: str | None = None,
+):
+    """
+    Build an Arrow table directly from the arrays of a dataset, using the same
+    row order as `Dataset.to_dataframe`.
+
+    Args:
+        ds: The dataset to convert
+        columns: Mapping of dimension, coordinate or variable names to output
+            column names. Only these columns are built.
+        null_subset: If defined, rows where all of these variables are null
+            are removed
+        mask: If defined, the boolean variable of the rows to keep
+    """
+    import pyarrow as pa
+
+    dims = list(ds.dims)
+    shape = tuple(ds.sizes[d] for d in dims)
+
+    def flatten(name: str) -> np.ndarray:
+        da = ds[name]
+        da = da.transpose(*[ d for d in dims if d in da.dims ])
+        values = np.asarray(da.values)
+        if da.dims != tuple(dims):
+            # Add the missing dimensions and repeat the values along them
+            expand = tuple(slice(None) if d in da.dims else np.newaxis for d in dims)
+            values = np.broadcast_to(values[expand], shape)
+        # A view of variables that already have every dimension in order
+        return values.ravel()
+
+    arrays = { name: flatten(name) for name in columns }
+
+    rows = np.ones(int(np.prod(shape)), dtype=bool)
+    if mask:
+        rows &= flatten(mask).astype(bool)
+    if null_subset:
+        nulls = np.ones(int(np.prod(shape)), dtype=bool)
+        for name in null_subset:
+            values = arrays[name] if name in arrays else flatten(name)
+            nulls &= pd.isnull(values)
+        rows &= ~nulls
+    if not rows.all():
+        arrays = { k: v[rows] for k, v in arrays.items() }
+
+    # Missing values (NaN, NaT) are nulls, like Table.from_pandas
+    return pa.table({
+        columns[k]: pa.array(v, from_pandas=True) for k, v in arrays.items()
+    })
+
+
+def write_jsonl(frames: Iterator[pd.DataFrame]) -> Iterator[str]:
+    for df in frames:
+        if df.empty:
+            continue
+        data = df.to_json(
+            orient='records',
+            lines=True,
+            date_format='iso',
+        )
+        if not data.endswith('\n'):
+            data += '\n'
+        yield data
+
+
+def write_parquet(frames: Iterator[pd.DataFrame]) -> Iterator[bytes]:
+    """
+    Write each dataframe as a row group of one Parquet file
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = StreamSink()
+    writer = None
+    empty = None
+    for df in frames:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if df.empty:
+            # The columns of an empty slice may not have their real types
+            # (i.e. object columns are null), so it never sets the schema
+            if empty is None:
+                empty = table
+            continue
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        elif not table.schema.equals(writer.schema):
+            # i.e. an integer column in one slice is a float column
+            # in another slice because it contains nulls
+            table = table.cast(writer.schema)
+        writer.write_table(table)
+        yield sink.drain()
+    if writer is None and empty is not None:
+        # Every slice was empty
+        writer = pq.ParquetWriter(sink, empty.schema)
+        writer.write_table(empty)
+    if writer is not None:
+        writer.close()
+    yield sink.drain()
+
+
+def write_arrow(tables: Iterator, file: bool = False) -> Iterator[bytes]:
+    """
+    Write each table as record batches of an Arrow IPC stream,
+    or an Arrow IPC file (Feather V2) if `file` is True
+    """
+    import pyarrow as pa
+
+    def new_writer(schema):
+        if file is True:
+            return pa.ipc.new_file(sink, schema)
+        return pa.ipc.new_stream(sink, schema)
+
+    sink = StreamSink()
+    writer = None
+    empty = None
+    for table in tables:
+        if table.num_rows == 0:
+            # See write_parquet
+            if empty is None:
+                empty = table
+            continue
+        if writer is None:
+            schema = table.schema
+            writer = new_writer(schema)
+        elif not table.schema.equals(schema):
+            table = table.cast(schema)
+        writer.write_table(table)
+        yield sink.drain()
+    if writer is None and empty is not None:
+        # Every slice was empty
+        writer = new_writer(empty.schema)
+        writer.write_table(empty)
+    if writer is not None:
+        writer.close()
+    yield sink.drain()
+
+
+class Timings:
+    """
+    The accumulated duration of each stage of building a response
+    and how many rows it contained
+    """
+
+    def __init__(self):
+        self.stages: dict[str, float] = {}
+        self.rows = 0
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name: str, elapsed: float):
+        self.stages[name] = self.stages.get(name, 0) + elapsed
+
+    def header(self) -> str:
+        """
+        The stages as a Server-Timing header value, in milliseconds
+        """
+        return ', '.join(
+            f'{k};dur={v * 1000:.1f}' for k, v in self.stages.items()
+        )
+
+    def record(self, dataset_id: str, fmt: str):
+        if metrics is not True:
+            return
+        for k, v in self.stages.items():
+            DATA_POINTS_STAGE_TIME.labels(
+                dataset=dataset_id,
+                format=fmt,
+                stage=k,
+                **DEFAULT_LABELS
+            ).observe(v)
+        DATA_POINTS_ROWS.labels(
+            dataset=dataset_id,
+            format=fmt,
+            **DEFAULT_LABELS
+        ).observe(self.rows)
+
+
+def dataset_generation(plugins: dict, dataset_id: str, dataset: xr.Dataset) -> int | None:
+    """
+    Ask the plugins that load datasets (i.e. the DatasetsConfigPlugin) for
+    the load generation of a dataset. None means the generation of the
+    dataset is unknown or the dataset is no longer the loaded dataset.
+    """
+    for p in plugins.values():
+        if hasattr(p, 'dataset_generation'):
+            generation = p.dataset_generation(dataset_id, dataset)
+            if generation is not None:
+                return generation
+    return None
+
+
+def dataset_extra(plugins: dict, dataset_id: str, dataset: xr.Dataset, key, factory):
+    """
+    Return an object derived from a dataset, cached until the dataset is
+    reloaded by the plugins that load datasets (i.e. the DatasetsConfigPlugin)
+    or built every time if no plugin caches it.
+    """
+    for p in plugins.values():
+        if hasattr(p, 'dataset_extra'):
+            value = p.dataset_extra(dataset_id, dataset, key, factory)
+            if value is not None:
+                return value
+    return factory(dataset)
 
 
 class DataPointsPlugin(Plugin):
@@ -48,16 +422,135 @@ class DataPointsPlugin(Plugin):
     dataset_router_prefix: str = '/data_points'
     dataset_router_tags: Sequence[str] = ['data_points']
 
+    # Maximum number of rows converted to a dataframe at a time
+    # when streaming responses
+    stream_max_rows: int = 100_000
+    # Maximum number of threads extracting data points at a time, defaults
+    # to the compute_threads of the RestConfig
+    compute_threads: int | None = None
+    # Responses up to this size are stored in the xpublish cache (see the
+    # cache_config of the RestConfig) until the dataset is reloaded. Defaults
+    # to 0 (disabled), the cache is shared with xpublish and the other plugins.
+    cache_max_bytes: int = 0
+    # Return how long each stage of building a response took in a
+    # Server-Timing header
+    server_timing: bool = False
+
+    __limiter: anyio.CapacityLimiter | None = None
+    __cache_keys: dict = {}
+    __cache_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def cache_put(self, cache, key: tuple, value, nbytes: int, cost: float):
+        """
+        Store a response in the cache and remove responses of
+        previous generations of the same dataset
+        """
+        if nbytes > self.cache_max_bytes:
+            return
+
+        _, dataset_id, generation, *_ = key
+        with self.__cache_lock:
+            current, keys = self.__cache_keys.get(dataset_id, (generation, set()))
+            if generation < current:
+                # The dataset was reloaded while this response was being built
+                return
+            elif generation > current:
+                for k in keys:
+                    if k in cache:
+                        cache.retire(k)
+                        # retire leaves the key in the heap the cache evicts from
+                        cache.heap.pop(k, None)
+                keys = set()
+            else:
+                # Forget the responses evicted from the cache since
+                keys = { k for k in keys if k in cache }
+
+            cache.put(key, value, cost=cost, nbytes=nbytes)
+            keys.add(key)
+            self.__cache_keys[dataset_id] = (generation, keys)
+
+    def limiter(self) -> anyio.CapacityLimiter:
+        # Created on first use, it needs to be created in the running event loop
+        if self.__limiter is None:
+            self.__limiter = anyio.CapacityLimiter(self.compute_threads or DEFAULT_COMPUTE_THREADS)
+        return self.__limiter
+
+    async def run(self, request: Request, func, cancelled: threading.Event):
+        """
+        Run a blocking function in the compute thread pool, giving up
+        on it if the client disconnects
+        """
+        result = None
+        async with anyio.create_task_group() as tg:
+
+            async def watch():
+                while not await request.is_disconnected():
+                    await anyio.sleep(DISCONNECT_POLL_INTERVAL)
+                L.info(f"Client disconnected, cancelling {request.url.path}")
+                cancelled.set()
+                tg.cancel_scope.cancel()
+
+            tg.start_soon(watch)
+            result = await anyio.to_thread.run_sync(
+                func,
+                limiter=self.limiter(),
+                abandon_on_cancel=True,
+            )
+            tg.cancel_scope.cancel()
+
+        return result
+
+    async def iterate(self, iterator: Iterator, cancelled: threading.Event):
+        """
+        Produce each item of a blocking iterator in the compute thread pool
+        """
+        done = object()
+        try:
+            while True:
+                item = await anyio.to_thread.run_sync(
+                    next,
+                    iterator,
+                    done,
+                    limiter=self.limiter(),
+                    abandon_on_cancel=True,
+                )
+                if item is done:
+                    break
+                yield item
+        finally:
+            # The client went away or the response is complete
+            cancelled.set()
+
     @hookimpl
     def dataset_router(self, deps: Dependencies):
 
         def grid_params(
             x_var: Annotated[str | None, Query()] = None,
             y_var: Annotated[str | None, Query()] = None,
+            longitude: Annotated[CommaSeparatedList[float] | None, Query()] = None,
+            latitude: Annotated[CommaSeparatedList[float] | None, Query()] = None,
+            x_start: Annotated[float | None, Query()] = None,
+            x_end: Annotated[float | None, Query()] = None,
+            y_start: Annotated[float | None, Query()] = None,
+            y_end: Annotated[float | None, Query()] = None,
+            x_istart: Annotated[int | None, Query()] = None,
+            x_iend: Annotated[int | None, Query()] = None,
+            y_istart: Annotated[int | None, Query()] = None,
+            y_iend: Annotated[int | None, Query()] = None,
         ):
             return {
                 'x_var': x_var,
                 'y_var': y_var,
+                'longitude': longitude,
+                'latitude': latitude,
+                'x_start': x_start,
+                'x_end': x_end,
+                'y_start': y_start,
+                'y_end': y_end,
+                'x_istart': x_istart,
+                'x_iend': x_iend,
+                'y_istart': y_istart,
+                'y_iend': y_iend,
             }
 
         def depth_params(
@@ -97,14 +590,41 @@ class DataPointsPlugin(Plugin):
 
         @router.get('/filter{fmt}', summary="Gets data points between 2 times for a list of variables")
         async def get_points(
+            request: Request,
+            response: Response,
+            dataset_id: str,
             fmt: DataFormat = '.jsonl',
             dataset=Depends(deps.dataset),
+            cache=Depends(deps.cache),
+            plugins=Depends(deps.plugins),
             time_params=Depends(time_params),
             depth_params=Depends(depth_params),
             var_params=Depends(var_params),
             grid_params=Depends(grid_params),
         ):
 
+            cache_key = None
+            if self.cache_max_bytes:
+                generation = dataset_generation(plugins, dataset_id, dataset)
+                if generation is not None:
+                    params = json.dumps(
+                        [time_params, depth_params, var_params, grid_params],
+                        sort_keys=True,
+                        default=str,
+                    )
+                    cache_key = (self.name, dataset_id, generation, fmt.value, params)
+
+                    cached = cache.get(cache_key)
+                    if cached is not None:
+                        media_type, content = cached
+                        headers = {}
+                        if self.server_timing:
+                            headers['Server-Timing'] = 'cache;desc="hit"'
+                        if media_type is None:
+                            response.headers.update(headers)
+                            return content
+                        return Response(content, media_type=media_type, headers=headers)
+
             selection = {}
             renames = {}
 
@@ -138,15 +658,108 @@ class DataPointsPlugin(Plugin):
             if grid_params['y_var']:
                 renames[grid_params['y_var']] = 'y'
 
-            # How far back to return data for
-            ds = dataset.sel(selection)
+            x_var, y_var = grid_params['x_var'], grid_params['y_var']
+
+            def require(v: str):
+                # Only needed for spatial subsets and points, otherwise
+                # x_var and y_var only name columns
+                if v not in dataset.variables:
+                    raise HTTPException(400, f"'{v}' not found in dataset variables")
+
+            # Spatial windows by coordinate values and by index
+            bounds = {}
+            islices = {}
+            for axis, var in [('x', x_var), ('y', y_var)]:
+                start, end = grid_params[f'{axis}_start'], grid_params[f'{axis}_end']
+                istart, iend = grid_params[f'{axis}_istart'], grid_params[f'{axis}_iend']
+                if start is None and end is None and istart is None and iend is None:
+                    continue
+                if not var:
+                    raise HTTPException(400, f"{axis}_var is required to subset along {axis}")
+                require(var)
+                if start is not None or end is not None:
+                    bounds[var] = (start, end, axis == 'x')
+                if istart is not None or iend is not None:
+                    # The last dimension of 2D coordinates is x and the one before it y
+                    dims = dataset[var].dims
+                    dim = dims[-2] if axis == 'y' and len(dims) > 1 else dims[-1]
+                    if dim in islices:
+                        raise HTTPException(400, f"x and y are both indexed along '{dim}'")
+                    islices[dim] = slice(istart, iend)
+
+            points = grid_params['longitude'] is not None or grid_params['latitude'] is not None
+            if points:
+                if not x_var or not y_var:
+                    raise HTTPException(400, "x_var and y_var are required to select points")
+                require(x_var)
+                require(y_var)
+                if bounds or islices:
+                    raise HTTPException(400, "Points can't be combined with a spatial subset")
+                if len(grid_params['longitude'] or []) != len(grid_params['latitude'] or []):
+                    raise HTTPException(400, "longitude and latitude must have the same length")
+                try:
+                    import scipy.spatial  # noqa: F401
+                except ImportError:
+                    raise HTTPException(501, "Selecting points requires scipy")
+
+            def nearest(ds: xr.Dataset) -> NearestIndex:
+                return NearestIndex(ds[grid_params['x_var']], ds[grid_params['y_var']])
+
+            def select() -> xr.Dataset:
+                # How far back to return data for
+                ds = dataset.sel(selection)
+
+                # Only read the spatial window that was requested
+                if islices:
+                    ds = ds.isel(islices)
+                if bounds:
+                    # Each dimension of 1D coordinates is indexed by its own mask,
+                    # i.e. both sides of the antimeridian on a rectilinear grid
+                    for var, (start, end, wrap) in bounds.items():
+                        if ds[var].ndim == 1:
+                            ds = ds.isel(grid_window(within(ds[var], start, end, wrap=wrap)))
+
+                    # Cells of 2D coordinates are read in the smallest window
+                    # containing the box and cells outside of it are marked
+                    mask = None
+                    for var, (start, end, wrap) in bounds.items():
+                        if ds[var].ndim > 1:
+                            inside = within(ds[var], start, end, wrap=wrap)
+                            mask = inside if mask is None else mask & inside
+                    if mask is not None:
+                        window = grid_window(mask)
+                        ds = ds.isel(window)
+                        inside = mask.isel(window).reset_coords(drop=True)
+                        if not inside.all():
+                            ds = ds.assign_coords({ INSIDE_VAR: inside.compute() })
+
+                # The grid cells nearest to the requested points
+                if points:
+                    index = dataset_extra(
+                        plugins,
+                        dataset_id,
+                        dataset,
+                        ('nearest', grid_params['x_var'], grid_params['y_var']),
+                        nearest,
+                    )
+                    ds = index.isel(ds, grid_params['longitude'], grid_params['latitude'])
+
+                # Subset to requested variables
+                if var_params['var']:
+                    ds = ds[var_params['var']]
+
+                return ds
+
+            timings = Timings()
 
-            # Subset to requested variables
-            if var_params['var']:
-                ds = ds[var_params['var']]
+            def timed_select() -> xr.Dataset:
+                with timings.stage('select'):
+                    return select()
 
-            # Convert to a dataframe
-            df = ds.to_dataframe().reset_index()
+            cancelled = threading.Event()
+            ds = await self.run(request, timed_select, cancelled)
+            if cancelled.is_set():
+                return Response(status_code=CLIENT_CLOSED_REQUEST)
 
             axis_vars = [
                 renames.get(time_params['var'], None),
@@ -155,60 +768,163 @@ class DataPointsPlugin(Plugin):
                 renames.get(grid_params['y_var'], None),
             ]
             axis_vars = [ x for x in axis_vars if x ]
+            if points:
+                axis_vars.insert(0, 'point')
 
             keep = axis_vars.copy()
+            if points:
+                keep.append('distance')
             keep += var_params['var'] or []
             keep += var_params['keep'] or []
 
-            if var_params['return_null'] is False:
-                df = df.dropna(how='all', subset=var_params['var'])
+            # Variables already named like a standardized axis, i.e. the "x"
+            # dimension of a grid with x_var=lon, are replaced by the axis
+            shadowed = set(renames.values()) - set(renames)
+
+            def to_frame(sub: xr.Dataset) -> pd.DataFrame:
+                # Convert to a dataframe
+                with timings.stage('to_dataframe'):
+                    df = sub.to_dataframe().reset_index()
+                    if INSIDE_VAR in df.columns:
+                        df = df[df[INSIDE_VAR].astype(bool)]
+
+                if var_params['return_null'] is False:
+                    with timings.stage('dropna'):
+                        df = df.dropna(how='all', subset=var_params['var'])
+
+                with timings.stage('to_dataframe'):
+                    df = df.reset_index(drop=True)
+
+                    # standardize axes
+                    if renames:
+                        df = df.drop(columns=[ c for c in df.columns if c in shadowed ])
+                        df = df.rename(columns=renames)
+
+                    df = df.drop(columns=[ c for c in df.columns if c not in keep ])
+
+                timings.rows += len(df)
+                return df
+
+            def to_table(sub: xr.Dataset):
+                import pyarrow as pa
+
+                if not sub.dims:
+                    return pa.Table.from_pandas(to_frame(sub), preserve_index=False)
+
+                # The same columns, in the same order, as to_frame
+                names = list(sub.dims)
+                names += [ v for v in sub.variables if v not in sub.dims ]
+                columns = {
+                    n: renames.get(n, n) for n in names
+                    if renames.get(n, n) in keep and n not in shadowed
+                }
+
+                null_subset = None
+                if var_params['return_null'] is False and var_params['var']:
+                    null_subset = var_params['var']
+
+                mask = INSIDE_VAR if INSIDE_VAR in sub.variables else None
+                with timings.stage('to_table'):
+                    table = dataset_to_arrow(sub, columns, null_subset, mask)
+                timings.rows += table.num_rows
+                return table
+
+            def slices() -> Iterator[xr.Dataset]:
+                for sub in stream_slices(ds, self.stream_max_rows):
+                    # Stop working on a response nobody is waiting for
+                    if cancelled.is_set():
+                        return
+                    yield sub
+
+            def to_dict():
+                started = time.perf_counter()
+                df = to_frame(ds)
+
+                with timings.stage('serialize'):
+                    if fmt in [
+                        DataFormat.SPLIT,
+                        DataFormat.TIGHT,
+                    ]:
+                        if axis_vars:
+                            df = df.set_index(axis_vars)
+
+                    data = df.to_dict(
+                        orient=fmt[1:]  # strip out the leading period,
+                    )
 
-            df = df.reset_index(drop=True)
+                if cache_key is not None:
+                    nbytes = int(df.memory_usage(deep=True).sum())
+                    cost = time.perf_counter() - started
+                    self.cache_put(cache, cache_key, (None, data), nbytes, cost)
 
-            # standardize axes
-            if renames:
-                df = df.rename(columns=renames)
+                return data
 
-            df = df.drop(columns=[ c for c in df.columns if c not in keep ])
+            def streaming(chunks: Iterator, media_type: str) -> Iterator[bytes]:
+                started = time.perf_counter()
+                parts = [] if cache_key is not None else None
+                nbytes = 0
+                # Everything producing the chunks that is not converting
+                # slices is serializing them
+                producing = 0
+                converting = sum(timings.stages.values())
+                try:
+                    while True:
+                        before = time.perf_counter()
+                        chunk = next(chunks, None)
+                        producing += time.perf_counter() - before
+                        if chunk is None:
+                            break
+
+                        if isinstance(chunk, str):
+                            chunk = chunk.encode('utf-8')
+                        if parts is not None:
+                            nbytes += len(chunk)
+                            parts.append(chunk)
+                            if nbytes > self.cache_max_bytes:
+                                # Too large to cache
+                                parts = None
+                        yield chunk
+                finally:
+                    converting = sum(timings.stages.values()) - converting
+                    timings.add('serialize', max(producing - converting, 0))
+                    timings.record(dataset_id, fmt.value)
+
+                if parts is not None and not cancelled.is_set():
+                    cost = time.perf_counter() - started
+                    self.cache_put(cache, cache_key, (media_type, b''.join(parts)), nbytes, cost)
 
             if fmt == DataFormat.JSONL:
-                data = df.to_json(
-                    orient='records',
-                    lines=True,
-                    date_format='iso',
-                )
-                return Response(
-                    data,
-                    media_type='application/jsonlines+json'
-                )
+                chunks = write_jsonl(map(to_frame, slices()))
+                media_type = 'application/jsonlines+json'
             elif fmt == DataFormat.PARQUET:
-
-                data = io.BytesIO()
-                df.to_parquet(
-                    data,
-                    index=None,
-                )
-
-                def stream():
-                    data.seek(0)
-                    yield from data
-
-                return StreamingResponse(
-                    stream(),
-                    # https://issues.apache.org/jira/browse/PARQUET-1889
-                    media_type="application/vnd.apache.parquet"
-                )
+                chunks = write_parquet(map(to_frame, slices()))
+                # https://issues.apache.org/jira/browse/PARQUET-1889
+                media_type = 'application/vnd.apache.parquet'
+            elif fmt == DataFormat.ARROW:
+                chunks = write_arrow(map(to_table, slices()))
+                media_type = 'application/vnd.apache.arrow.stream'
+            elif fmt == DataFormat.FEATHER:
+                chunks = write_arrow(map(to_table, slices()), file=True)
+                media_type = 'application/vnd.apache.arrow.file'
             else:
-                if fmt in [
-                    DataFormat.SPLIT,
-                    DataFormat.TIGHT,
-                ]:
-                    if axis_vars:
-                        df = df.set_index(axis_vars)
-
-                data = df.to_dict(
-                    orient=fmt[1:]  # strip out the leading period,
-                )
+                data = await self.run(request, to_dict, cancelled)
+                if cancelled.is_set():
+                    return Response(status_code=CLIENT_CLOSED_REQUEST)
+                timings.record(dataset_id, fmt.value)
+                if self.server_timing:
+                    response.headers['Server-Timing'] = timings.header()
                 return data
 
+            # Headers are sent before the body is produced, only the
+            # selection has been timed at this point
+            headers = {}
+            if self.server_timing:
+                headers['Server-Timing'] = timings.header()
+
+            return StreamingResponse(
+                self.iterate(streaming(chunks, media_type), cancelled),
+                media_type=media_type,
+                headers=headers,
+            )
+
         return router
@@ -0,0 +1,137 @@
+import fcntl
+import logging
+import os
+import pickle
+import stat
+import tempfile
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+L = logging.getLogger(__name__)
+
+# Set by the gunicorn master process when it starts so every worker of a
+# server run shares the same pickles. Without it each process uses its own.
+RUN_ENV = 'XPUB_SHARED_CACHE_RUN'
+_run = uuid.uuid4().hex
+
+
+def run_token() -> str:
+    return os.environ.get(RUN_ENV) or _run
+
+
+class SharedDatasetCache:
+    """
+    A directory of pickled datasets shared by all of the processes on a node.
+
+    Loaded datasets are usually lazy (dask backed) so the pickles only contain
+    the dataset structure, the task graph and any computed coordinates. Reading
+    one back is much cheaper than calling the loader again, which re-globs files
+    and opens each of them to compute the axes. A per-dataset file lock makes sure
+    only one process on the node calls the loader at a time and the others read
+    the result.
+
+    Pickles are only shared within one server run (see `RUN_ENV`), those
+    left by previous runs are never read. Reading a pickle can run arbitrary
+    code so the directory must be owned by the current user and not writable
+    by anyone else, otherwise a `PermissionError` is raised.
+    """
+
+    def __init__(self, directory: str | Path, run: str | None = None):
+        self.directory = Path(directory)
+        self.run = run or run_token()
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+        info = self.directory.stat()
+        if info.st_uid != os.getuid():
+            raise PermissionError(f"{self.directory} is not owned by the current user")
+        if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise PermissionError(f"{self.directory} is writable by other users")
+
+    def dataset_directory(self, config) -> Path:
+        # One directory per dataset so a dataset only ever sees its own files
+        directory = self.directory / config.id
+        directory.mkdir(mode=0o700, exist_ok=True)
+        return directory
+
+    def path(self, config) -> Path:
+        return self.dataset_directory(config) / f'{self.run}.{config.fingerprint()}.pickle'
+
+    @contextmanager
+    def lock(self, config):
+        lock_path = self.dataset_directory(config) / '.lock'
+        with open(lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get(self, config, newer_than: float = 0):
+        """
+        Return a cached dataset and when it was written if one exists that was
+        written after `newer_than` and has not expired according to the
+        `invalidate_after` of the config
+        """
+        path = self.path(config)
+        try:
+            written = path.stat().st_mtime
+        except FileNotFoundError:
+            return None, None
+
+        now = datetime.now(timezone.utc).timestamp()
+        if written < newer_than:
+            return None, None
+        if config.invalidate_after is not None and (now - written) >= config.invalidate_after:
+            return None, None
+
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f), written
+        except BaseException as e:
+            L.warning(f"Could not read shared dataset {config.id} from {path}: {e}")
+            return None, None
+
+    def put(self, config, dataset):
+        path = self.path(config)
+        try:
+            with tempfile.NamedTemporaryFile(
+                dir=path.parent,
+                prefix='.',
+                delete=False
+            ) as f:
+                pickle.dump(dataset, f, protocol=pickle.HIGHEST_PROTOCOL)
+            # Readers only ever see a complete file
+            os.replace(f.name, path)
+        except BaseException as e:
+            L.warning(f"Could not share dataset {config.id} through {path}: {e}")
+            try:
+                os.unlink(f.name)
+            except BaseException:
+                pass
+            return False
+
+        # Remove cached copies from previous versions of the config or previous runs
+        for old in path.parent.glob('*.pickle'):
+            if old != path:
+                old.unlink(missing_ok=True)
+        return True
+
+    def load(self, config, newer_than: float = 0):
+        """
+        Load a dataset through the shared cache. Only one process loads a
+        dataset at a time and the others wait and use the shared result.
+
+        Returns the dataset and the timestamp of when it was loaded.
+        """
+        with self.lock(config):
+            dataset, written = self.get(config, newer_than=newer_than)
+            if dataset is not None:
+                L.info(f"Using shared dataset: {config.id}")
+                return dataset, written
+
+            loaded = datetime.now(timezone.utc).timestamp()
+            dataset = config.load()
+            self.put(config, dataset)
+            return dataset, loaded
@@ -1,15 +1,46 @@
+import hashlib
+import hmac
 import logging
 import os
+import tempfile
+import threading
+import time
 import typing as t
+from collections import OrderedDict
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    wait,
+)
 from datetime import datetime, timezone
+from pathlib import Path
 
+import dask.array as da
 import xarray as xr
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    status,
+)
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from goodconf import GoodConf
-from pydantic import BaseModel, FilePath
+from pydantic import (
+    BaseModel,
+    FilePath,
+    PrivateAttr,
+)
 from pydantic.types import ImportString
 
-from xpublish import Plugin, hookimpl
+from xpublish import (
+    Dependencies,
+    Plugin,
+    hookimpl,
+)
 from xpublish_host.config import RestConfig
+from xpublish_host.metrics import DATASET_LABEL
+from xpublish_host.plugins.dcache import SharedDatasetCache
+from xpublish_host.plugins.dwatch import FileWatcher
 
 try:
     from prometheus_client import Counter, Gauge
@@ -34,12 +65,53 @@ try:
         "When the dataset was last loaded",
         ["dataset"],
     )
+    DATASET_MATERIALIZED_BYTES = create_metric(
+        Gauge,
+        "dataset_materialized_bytes",
+        "How many bytes of the dataset were read into memory when it was loaded",
+        ["dataset"],
+    )
+    DATASET_EVICTIONS = create_metric(
+        Counter,
+        "dataset_evictions",
+        "How many times a dataset has been evicted to stay within the process limits",
+        ["dataset", "reason"],
+    )
+    DATASETS_OPEN = create_metric(
+        Gauge,
+        "datasets_open",
+        "How many datasets are loaded in the process",
+        [],
+    )
+    DATASETS_MEMORY = create_metric(
+        Gauge,
+        "datasets_memory_bytes",
+        "The in-memory size of the datasets loaded in the process",
+        [],
+    )
 except ImportError:
     metrics = False
 
 L = logging.getLogger(__name__)
 
 
+ADMIN_ACTIONS = ('invalidate', 'reload', 'preload')
+
+
+class MaterializeConfig(BaseModel):
+    """
+    Which lazy arrays of a dataset are read into memory each time it is loaded
+    """
+    # Total bytes read into memory, arrays that don't fit are left lazy
+    memory_budget: int = 2 ** 28
+    # Coordinates and data variables up to this size, smallest first
+    max_variable_bytes: int = 2 ** 20
+    # The last `tail_steps` steps along `time_dim` of the `tail_variables`
+    tail_variables: list[str] = []
+    tail_steps: int = 0
+    time_dim: str = 'time'
+
+
 class DatasetConfig(BaseModel):
     id: str
     title: str
@@ -49,9 +121,50 @@ class DatasetConfig(BaseModel):
     kwargs: dict[str, t.Any] = {}
     invalidate_after: int | None = None
     skip_initial_load: bool = False
+    # Keep serving the expired dataset while it is reloaded in a background thread
+    background_reload: bool = False
+    # Seconds to wait for the initial load before starting without the dataset
+    load_timeout: float | None = None
+    # Read lazy coordinate arrays into memory after each load
+    warmup: bool = False
+    # Read small arrays and the most recent time steps into memory after each load
+    materialize: MaterializeConfig | None = None
+    # Reload when files matching the root_path and file_glob of the loader change
+    watch_files: bool = False
+    # Seconds between scans of the files when not using filesystem events
+    watch_interval: float = 10
+    # Use filesystem events when watchdog is installed, scan network filesystems instead
+    watch_events: bool = True
+
+    def watch_paths(self) -> tuple[str, str] | None:
+        """
+        The root_path and file_glob arguments of the loader (i.e. load_mfdataset)
+        """
+        args = list(self.args)
+        root_path = self.kwargs.get('root_path', args[0] if len(args) > 0 else None)
+        file_glob = self.kwargs.get('file_glob', args[1] if len(args) > 1 else None)
+        if root_path is None or file_glob is None:
+            return None
+        return str(root_path), str(file_glob)
 
     def load(self):
-        return self.loader(*self.args, **self.kwargs)
+        dataset = self.loader(*self.args, **self.kwargs)
+        if self.warmup:
+            dataset = warm_dataset(dataset)
+        if self.materialize is not None:
+            dataset = materialize_dataset(dataset, self.materialize)
+        return dataset
+
+    def fingerprint(self) -> str:
+        """
+        A hash of the fields that control how the dataset is loaded
+        """
+        dumped = self.model_dump_json(
+            include={'id', 'loader', 'args', 'kwargs'},
+            fallback=str,
+            warnings=False,
+        )
+        return hashlib.sha1(dumped.encode('utf-8')).hexdigest()
 
     def serve(self, **rest_kwargs):
         """
@@ -70,6 +183,108 @@ class DatasetConfig(BaseModel):
         )
 
 
+def warm_dataset(dataset: xr.Dataset) -> xr.Dataset:
+    """
+    Read the lazy (dask backed) coordinate arrays of a dataset into memory.
+    Almost every request reads them, this keeps the first requests after a
+    load from paying for it.
+    """
+    lazy = {
+        k: v for k, v in dataset.coords.items()
+        if v.chunks is not None
+    }
+    if lazy:
+        L.info(f"Warming up coordinates: {list(lazy)}")
+        dataset = dataset.assign_coords({ k: v.compute() for k, v in lazy.items() })
+    return dataset
+
+
+def materialize_dataset(dataset: xr.Dataset, config: MaterializeConfig) -> xr.Dataset:
+    """
+    Read lazy (dask backed) arrays of a dataset into memory within the
+    `memory_budget` of the config: coordinates, then data variables up to
+    `max_variable_bytes` (smallest first), then the last `tail_steps` of
+    the `tail_variables`. The tails replace the matching chunks of the
+    lazy arrays so reading recent data never touches the files.
+    """
+    remaining = config.memory_budget
+    updates = {}
+
+    def fits(name: str, nbytes: int) -> bool:
+        nonlocal remaining
+        if nbytes > remaining:
+            L.info(f"Not materializing {name} ({nbytes} bytes), over the memory budget")
+            return False
+        remaining -= nbytes
+        return True
+
+    lazy_coords = sorted(
+        (v for v in dataset.coords.values() if v.chunks is not None),
+        key=lambda v: v.nbytes
+    )
+    lazy_vars = sorted(
+        (
+            v for v in dataset.data_vars.values()
+            if v.chunks is not None and v.nbytes <= config.max_variable_bytes
+        ),
+        key=lambda v: v.nbytes
+    )
+    for v in lazy_coords + lazy_vars:
+        if fits(v.name, v.nbytes):
+            updates[v.name] = v.compute()
+
+    for name in config.tail_variables:
+        v = dataset.get(name)
+        if v is None or name in updates or v.chunks is None or config.time_dim not in v.dims:
+            continue
+        steps = min(config.tail_steps, v.sizes[config.time_dim])
+        if steps <= 0:
+            continue
+
+        axis = v.get_axis_num(config.time_dim)
+        head = v.isel({ config.time_dim: slice(None, -steps) })
+        tail = v.isel({ config.time_dim: slice(-steps, None) })
+        if not fits(f'{name} tail', tail.nbytes):
+            continue
+        # Keep the original chunks, the zarr endpoint requires regular chunks
+        data = da.concatenate(
+            [head.data, da.from_array(tail.values, chunks=-1)],
+            axis=axis
+        ).rechunk(v.data.chunks)
+        updates[name] = v.copy(data=data)
+
+    materialized = config.memory_budget - remaining
+    if metrics is True:
+        DATASET_MATERIALIZED_BYTES.labels(
+            dataset=DATASET_LABEL.get(),
+            **DEFAULT_LABELS
+        ).set(materialized)
+
+    if not updates:
+        return dataset
+
+    L.info(f"Materialized {list(updates)} ({materialized} bytes)")
+    coords = { k: v for k, v in updates.items() if k in dataset.coords }
+    data_vars = { k: v for k, v in updates.items() if k not in coords }
+    dataset = dataset.assign_coords(coords)
+    for k, v in data_vars.items():
+        # Keep the encoding and attributes of the lazy variable
+        dataset[k] = dataset[k].copy(data=v.data)
+    return dataset
+
+
+def dataset_memory(dataset: xr.Dataset) -> int:
+    """
+    The size of the arrays of a dataset that are not dask backed. Arrays read
+    lazily from a file without dask are counted too, once read they are kept
+    in memory.
+    """
+    return sum(
+        v.nbytes for v in dataset.variables.values()
+        if v.chunks is None
+    )
+
+
 class DatasetConfigFile(GoodConf):
     datasets_config: dict[str, DatasetConfig] = {}
 
@@ -80,21 +295,148 @@ class DatasetsConfigPlugin(Plugin):
 
     datasets_config: dict[str, DatasetConfig] = {}
     datasets_config_file: FilePath = None
-
+    # Directory used to share loaded datasets between the processes on a node
+    shared_cache_dir: Path | None = None
+    # How many datasets are loaded at the same time when the plugin starts
+    initial_load_workers: int = 1
+    # Evict the least recently used datasets past this many loaded datasets
+    max_open_datasets: int | None = None
+    # Evict the least recently used datasets past this many bytes of in-memory arrays
+    max_datasets_memory: int | None = None
+    # Seconds between checks of the config file for changes, applied without a restart
+    config_poll_interval: float | None = None
+    # Bearer token of the admin routes, defaults to XPUB_ADMIN_TOKEN. Without
+    # a token the admin routes are not available.
+    admin_token: str | None = None
+    # Directory used to send admin actions to every process on a node
+    admin_signal_dir: Path | None = None
+    # Seconds between checks of admin_signal_dir for actions
+    admin_poll_interval: float = 1
+
+    app_router_prefix: str = '/admin'
+    app_router_tags: t.Sequence[str] = ['admin']
+
+    __configs: dict[str, DatasetConfig] = {}
     __datasets: dict = {}
     __datasets_loaded: dict = {}
+    __datasets_invalidated: dict = {}
+    __datasets_generation: dict = {}
+    __datasets_status: dict = {}
+    __datasets_extras: dict = {}
+    __extras_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    __datasets_reloading: set = set()
+    __reload_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    __shared_cache: SharedDatasetCache | None = None
+    __load_locks: dict = {}
+    __datasets_used: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    __datasets_memory: dict = {}
+    __used_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    __static_configs: dict = {}
+    __file_configs: dict = {}
+    __config_identity: tuple = ()
+    __config_checked: float = 0
+    __config_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    __signals_seen: dict = {}
+    __signals_checked: float = 0
+    __signals_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    __watchers: dict = {}
+    __watchers_pid: int | None = None
+    __watchers_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    __load_locks_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        config_file_datasets = self.load_config_file()
+        if self.shared_cache_dir:
+            try:
+                self.__shared_cache = SharedDatasetCache(self.shared_cache_dir)
+            except OSError as e:
+                L.warning(f"Not sharing datasets through {self.shared_cache_dir}: {e}")
 
-        self.datasets_config.update(config_file_datasets)
+        self.__static_configs = dict(self.datasets_config)
+        self.__config_identity = self.config_file_identity()
+        self.__config_checked = time.monotonic()
+        self.__file_configs = self.load_config_file()
 
-        for dsc in self.datasets_config.values():
-            if dsc.skip_initial_load is False:
+        self.datasets_config.update(self.__file_configs)
+        self.__configs = { v.id: v for v in self.datasets_config.values() }
+
+        if self.admin_signal_dir:
+            self.admin_signal_dir.mkdir(parents=True, exist_ok=True)
+            # Actions sent before this process started don't apply to it
+            self.__signals_seen = self.read_signals()
+            self.__signals_checked = time.monotonic()
+
+        self.initial_load()
+
+    def initial_load(self):
+        """
+        Load the datasets without `skip_initial_load`, at most
+        `initial_load_workers` at the same time. A dataset that takes longer
+        than its `load_timeout` keeps loading in the background, without
+        taking up a worker, and is served once it finishes. Startup does
+        not wait for it.
+        """
+        configs = [
+            dsc for dsc in self.datasets_config.values()
+            if dsc.skip_initial_load is False
+        ]
+        if not configs:
+            return
+
+        workers = max(1, min(self.initial_load_workers, len(configs)))
+        queued = list(configs)
+        running: dict[Future, tuple[DatasetConfig, float]] = {}
+
+        def start(dsc: DatasetConfig):
+            future = Future()
+
+            def load():
                 L.info(f"Loading dataset (initial): {dsc.id}")
-                _ = self.load_dataset(dsc)
+                try:
+                    future.set_result(self.load_dataset(dsc))
+                except BaseException as e:
+                    future.set_exception(e)
+
+            # Daemon threads so loads that timed out don't keep the process alive
+            threading.Thread(
+                target=load,
+                name=f'xpublish-initial-load-{dsc.id}',
+                daemon=True,
+            ).start()
+            running[future] = (dsc, time.monotonic())
+
+        def failed_late(dsc: DatasetConfig, future: Future):
+            if future.exception() is not None:
+                L.error(f"Could not load dataset {dsc.id}: {future.exception()}")
+
+        while queued or running:
+            while queued and len(running) < workers:
+                start(queued.pop(0))
+
+            deadlines = [
+                started + dsc.load_timeout
+                for dsc, started in running.values()
+                if dsc.load_timeout is not None
+            ]
+            timeout = max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for f in done:
+                running.pop(f)
+                # Raise any errors like a sequential load would
+                f.result()
+
+            # Stop waiting on loads that have been running for longer than their
+            # timeout, which frees their worker for the queued datasets
+            now = time.monotonic()
+            for f, (dsc, started) in list(running.items()):
+                if dsc.load_timeout is not None and started + dsc.load_timeout <= now:
+                    L.error(
+                        f"Timed out loading dataset {dsc.id} after {dsc.load_timeout}s, "
+                        "it will be served when it finishes loading"
+                    )
+                    running.pop(f)
+                    f.add_done_callback(lambda f, dsc=dsc: failed_late(dsc, f))
 
     def load_config_file(self):
         # Load a config file into a dict of DatasetConfigs
@@ -113,22 +455,234 @@ class DatasetsConfigPlugin(Plugin):
 
         return {}
 
+    def config_files(self) -> list[str]:
+        files = [ os.environ.get('XPUBDC_CONFIG_FILE', None), self.datasets_config_file ]
+        return [ str(f) for f in files if f ]
+
+    def config_file_identity(self) -> tuple:
+        """
+        The modification time and size of each config file
+        """
+        identity = []
+        for f in self.config_files():
+            try:
+                stat = os.stat(f)
+                identity.append((f, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                identity.append((f, None, None))
+        return tuple(identity)
+
+    def poll_config(self):
+        """
+        Apply changes to the config file, checking at most once every
+        `config_poll_interval` seconds
+        """
+        if self.config_poll_interval is None:
+            return
+        now = time.monotonic()
+        if now - self.__config_checked < self.config_poll_interval:
+            return
+        # Only one thread checks, the others keep serving requests
+        if not self.__config_lock.acquire(blocking=False):
+            return
+        try:
+            self.__config_checked = now
+            identity = self.config_file_identity()
+            if identity == self.__config_identity:
+                return
+            try:
+                file_configs = self.load_config_file()
+            except Exception as e:
+                L.error(f"Could not load changed config file, keeping the current config: {e}")
+                return
+            self.__config_identity = identity
+            self.apply_config(file_configs)
+        finally:
+            self.__config_lock.release()
+
+    def apply_config(self, file_configs: dict[str, DatasetConfig]):
+        """
+        Replace the datasets defined in the config file: added datasets are
+        loaded, changed datasets that are loaded are reloaded in the background
+        and removed datasets are dropped. Other datasets are left loaded.
+        """
+        old = { v.id: v for v in self.__file_configs.values() }
+        new = { v.id: v for v in file_configs.values() }
+
+        self.__file_configs = file_configs
+        self.datasets_config = { **self.__static_configs, **file_configs }
+        self.__configs = { v.id: v for v in self.datasets_config.values() }
+
+        for dataset_id in old.keys() - new.keys():
+            self.stop_file_watcher(dataset_id)
+            if dataset_id not in self.__configs:
+                L.info(f"Removing dataset {dataset_id}, removed from the config file")
+                # Wait for a load in progress so it isn't left loaded
+                self.evict_dataset(dataset_id, reason='removed', blocking=True)
+                self.__datasets_status.pop(dataset_id, None)
+
+        for dataset_id, dsc in new.items():
+            if dataset_id in old and old[dataset_id] == dsc:
+                continue
+            self.stop_file_watcher(dataset_id)
+            if dataset_id in self.__datasets:
+                L.info(f"Reloading dataset {dataset_id}, changed in the config file")
+                self.reload_dataset_background(dsc)
+            elif dataset_id not in old and dsc.skip_initial_load is False:
+                L.info(f"Loading dataset {dataset_id}, added to the config file")
+                self.reload_dataset_background(dsc)
+
+    def read_signals(self) -> dict[str, int]:
+        signals = {}
+        for entry in os.scandir(self.admin_signal_dir):
+            if entry.name.startswith('.'):
+                continue
+            try:
+                signals[entry.name] = entry.stat().st_mtime_ns
+            except FileNotFoundError:
+                continue
+        return signals
+
+    def send_signal(self, dataset_id: str, action: str):
+        """
+        Tell the other processes using `admin_signal_dir` to apply an action
+        """
+        path = self.admin_signal_dir / f'{dataset_id}.{action}'
+        fd, tmp = tempfile.mkstemp(dir=self.admin_signal_dir, prefix='.')
+        os.close(fd)
+        os.replace(tmp, path)
+        with self.__signals_lock:
+            self.__signals_seen[path.name] = path.stat().st_mtime_ns
+
+    def poll_signals(self):
+        """
+        Apply actions sent by other processes, checking at most once
+        every `admin_poll_interval` seconds
+        """
+        if not self.admin_signal_dir:
+            return
+        now = time.monotonic()
+        if now - self.__signals_checked < self.admin_poll_interval:
+            return
+        if not self.__signals_lock.acquire(blocking=False):
+            return
+        try:
+            self.__signals_checked = now
+            signals = self.read_signals()
+            sent = [
+                (name, mtime) for name, mtime in signals.items()
+                if self.__signals_seen.get(name) != mtime
+            ]
+            self.__signals_seen = signals
+        finally:
+            self.__signals_lock.release()
+
+        for name, mtime in sent:
+            dataset_id, _, action = name.rpartition('.')
+            dsc = self.__configs.get(dataset_id)
+            if dsc is not None and action in ADMIN_ACTIONS:
+                self.apply_action(dsc, action, sent=mtime / 1e9)
+
+    def apply_action(self, config: DatasetConfig, action: str, sent: float | None = None):
+        """
+        Apply an admin action to a dataset in this process:
+
+        * `invalidate` - drop the dataset, the next request loads it again
+        * `reload` - reload the dataset in the background, serving the current one until then
+        * `preload` - load the dataset in the background if it isn't loaded
+
+        Datasets shared through `shared_cache_dir` before the action was
+        `sent` are not used by the loads started by `invalidate` and `reload`.
+        """
+        L.info(f"Applying admin action {action} to dataset {config.id}")
+        if action in ('invalidate', 'reload'):
+            if sent is None:
+                sent = datetime.now(timezone.utc).timestamp()
+            self.__datasets_invalidated[config.id] = max(
+                sent,
+                self.__datasets_invalidated.get(config.id, 0)
+            )
+
+        if action == 'invalidate':
+            self.evict_dataset(config.id, reason='invalidated', blocking=True)
+        elif action == 'reload':
+            self.reload_dataset_background(config)
+        elif action == 'preload' and config.id not in self.__datasets:
+            self.reload_dataset_background(config)
+
+    @hookimpl
+    def app_router(self, deps: Dependencies):
+        router = APIRouter(prefix=self.app_router_prefix, tags=list(self.app_router_tags))
+
+        token = self.admin_token or os.environ.get('XPUB_ADMIN_TOKEN')
+        if not token:
+            return router
+
+        bearer = HTTPBearer(auto_error=False)
+
+        def authorized(credentials: HTTPAuthorizationCredentials | None = Depends(bearer)):
+            if credentials is None or not hmac.compare_digest(
+                credentials.credentials.encode('utf-8'),
+                token.encode('utf-8'),
+            ):
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail='Invalid admin token',
+                    headers={'WWW-Authenticate': 'Bearer'},
+                )
+
+        @router.post(
+            '/datasets/{dataset_id}/{action}',
+            status_code=status.HTTP_202_ACCEPTED,
+            dependencies=[Depends(authorized)],
+        )
+        def dataset_action(dataset_id: str, action: t.Literal[ADMIN_ACTIONS]):
+            dsc = self.__configs.get(dataset_id)
+            if dsc is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f'Dataset {dataset_id} not found',
+                )
+
+            self.apply_action(dsc, action)
+            if self.admin_signal_dir:
+                self.send_signal(dataset_id, action)
+
+            return dict(
+                dataset=dataset_id,
+                action=action,
+                processes='all' if self.admin_signal_dir else 'this',
+            )
+
+        return router
+
     @hookimpl
     def get_datasets(self):
-        return [ v.id for v in self.datasets_config.values() ]
+        self.poll_config()
+        self.poll_signals()
+        return list(self.__configs)
+
+    def dataset_lock(self, dataset_id: str) -> threading.RLock:
+        """
+        The lock held while a dataset is loaded, so concurrent loads of
+        the same dataset wait on each other
+        """
+        with self.__load_locks_lock:
+            return self.__load_locks.setdefault(dataset_id, threading.RLock())
 
     @hookimpl
     def get_dataset(self, dataset_id: str) -> xr.Dataset:
 
-        try:
-            dsc = next(v for v in self.datasets_config.values() if v.id == dataset_id)
-        except StopIteration:
+        self.poll_config()
+        self.poll_signals()
+        dsc = self.__configs.get(dataset_id)
+        if dsc is None:
             return
+        # Read before checking the dataset so a load finishing after this is noticed
+        generation = self.__datasets_generation.get(dataset_id)
 
-        # TODO: Cache check. We could potentially check a cache to see if this dataset
-        # should be reloaded after a certain timeout or key expiration. This could be
-        # set through an HTTP endpoint to invalidate a dataset's cache. This cache needs
-        # to be on the per-process level since that is where the datasets are accessed
+        # Datasets invalidated through the admin routes have already been
+        # dropped by poll_signals (or the route itself) and are loaded below
         cache_check = True
 
         # Expiration check, after X amount of time, invalidate the dataset
@@ -138,25 +692,304 @@ class DatasetsConfigPlugin(Plugin):
             now = datetime.now(timezone.utc).timestamp()
             expiration_check = (now - last_updated) < dsc.invalidate_after
 
+        # Change check, invalidate the dataset when its files change
+        watcher = self.file_watcher(dsc)
+        if watcher is not None and expiration_check:
+            last_updated = self.__datasets_loaded.get(dataset_id, 0)
+            expiration_check = not watcher.changed_after(last_updated)
+
         if dataset_id in self.__datasets and cache_check and expiration_check:
+            self.dataset_used(dataset_id)
+            return self.__datasets[dataset_id]
+
+        # Serve the stale dataset while a single background thread replaces it
+        if dataset_id in self.__datasets and cache_check and dsc.background_reload:
+            self.reload_dataset_background(dsc)
             return self.__datasets[dataset_id]
 
-        # If we got here, load the dataset
-        L.info(f"Loading dataset: {dsc.id}")
-        dataset = self.load_dataset(dsc)
+        # If we got here, load the dataset. Requests that arrive while it
+        # is being loaded wait for and use that load instead of starting another.
+        with self.dataset_lock(dataset_id):
+            if (
+                dataset_id in self.__datasets and
+                self.__datasets_generation.get(dataset_id) != generation
+            ):
+                return self.__datasets[dataset_id]
+            L.info(f"Loading dataset: {dsc.id}")
+            dataset = self.load_dataset(dsc)
         return dataset
 
+    def file_watcher(self, config: DatasetConfig) -> FileWatcher | None:
+        """
+        The watcher of the files of a dataset with `watch_files`, started
+        the first time it is requested in each process
+        """
+        if not config.watch_files:
+            return None
+
+        pid = os.getpid()
+        if self.__watchers_pid == pid and config.id in self.__watchers:
+            return self.__watchers[config.id]
+
+        with self.__watchers_lock:
+            if self.__watchers_pid != pid:
+                # The threads of watchers started before a fork are gone
+                self.__watchers = {}
+                self.__watchers_pid = pid
+            if config.id not in self.__watchers:
+                paths = config.watch_paths()
+                if paths is None:
+                    L.warning(f"Dataset {config.id} has no root_path and file_glob to watch")
+                    watcher = None
+                else:
+                    L.info(f"Watching {paths} for changes to dataset {config.id}")
+                    watcher = FileWatcher(
+                        *paths,
+                        interval=config.watch_interval,
+                        events=config.watch_events,
+                    ).start()
+                self.__watchers[config.id] = watcher
+            return self.__watchers[config.id]
+
+    def stop_file_watcher(self, dataset_id: str):
+        with self.__watchers_lock:
+            watcher = self.__watchers.pop(dataset_id, None)
+        if watcher is not None:
+            watcher.stop()
+
     def load_dataset(self, config: DatasetConfig):
-        now = datetime.utcnow().timestamp()
-        dataset = config.load()
+        with self.dataset_lock(config.id):
+            return self._load_dataset(config)
+
+    def _load_dataset(self, config: DatasetConfig):
+        # Timezone aware so these can be compared with file modification times
+        started = now = datetime.now(timezone.utc).timestamp()
+        previous = self.__datasets_status.get(config.id, {})
+        self.__datasets_status[config.id] = dict(previous, state='loading')
+        # Label any metrics recorded by the loader with the dataset
+        label = DATASET_LABEL.set(config.id)
+        try:
+            if self.__shared_cache is not None:
+                # Another process may have loaded the dataset already, use
+                # when that happened as the load time
+                newer_than = max(
+                    self.__datasets_loaded.get(config.id, 0),
+                    # Don't use a dataset shared before an admin action
+                    self.__datasets_invalidated.get(config.id, 0),
+                )
+                watcher = self.__watchers.get(config.id)
+                if watcher is not None:
+                    # Don't use a dataset shared before the files changed
+                    newer_than = max(newer_than, watcher.last_change)
+                dataset, now = self.__shared_cache.load(
+                    config,
+                    newer_than=newer_than
+                )
+            else:
+                dataset = config.load()
+        except BaseException as e:
+            self.__datasets_status[config.id] = dict(previous, state='failed', error=str(e))
+            raise
+        finally:
+            DATASET_LABEL.reset(label)
 
         if metrics is True:
-            after = datetime.utcnow().timestamp()
-            elapsed = after - now
+            after = datetime.now(timezone.utc).timestamp()
+            elapsed = after - started
             DATASET_LOAD_TIME.labels(dataset=config.id, **DEFAULT_LABELS).set(elapsed)
             DATASET_LOAD_WHEN.labels(dataset=config.id, **DEFAULT_LABELS).set(after)
             DATASET_LOAD_COUNT.labels(dataset=config.id, **DEFAULT_LABELS).inc()
 
+        if config.id not in self.__configs:
+            # Removed from the config file while it was loading (i.e. a
+            # background reload), serve it this once but don't keep it
+            L.info(f"Not keeping dataset {config.id}, removed from the config file")
+            self.evict_dataset(config.id, reason='removed')
+            self.__datasets_status.pop(config.id, None)
+            return dataset
+
         self.__datasets[config.id] = dataset
         self.__datasets_loaded[config.id] = now
-        return self.__datasets[config.id]
+        self.__datasets_generation[config.id] = self.__datasets_generation.get(config.id, 0) + 1
+        self.__datasets_status[config.id] = dict(state='loaded', loaded=now)
+        # Anything derived from the previous dataset is rebuilt on demand
+        with self.__extras_lock:
+            self.__datasets_extras.pop(config.id, None)
+
+        self.__datasets_memory[config.id] = dataset_memory(dataset)
+        self.dataset_used(config.id)
+        self.evict_datasets(keep=config.id)
+        return dataset
+
+    def dataset_used(self, dataset_id: str):
+        with self.__used_lock:
+            self.__datasets_used[dataset_id] = None
+            self.__datasets_used.move_to_end(dataset_id)
+
+    def evict_datasets(self, keep: str | None = None):
+        """
+        Evict the least recently used datasets until the process is within
+        `max_open_datasets` and `max_datasets_memory`. Evicted datasets
+        are loaded again the next time they are requested.
+        """
+        while True:
+            with self.__used_lock:
+                loaded = [ k for k in self.__datasets_used if k in self.__datasets ]
+            memory = sum(self.__datasets_memory.get(k, 0) for k in loaded)
+
+            reason = None
+            if self.max_open_datasets is not None and len(loaded) > self.max_open_datasets:
+                reason = 'max_open_datasets'
+            elif self.max_datasets_memory is not None and memory > self.max_datasets_memory:
+                reason = 'max_datasets_memory'
+
+            evicted = None
+            if reason is not None:
+                for dataset_id in loaded:
+                    if dataset_id != keep and self.evict_dataset(dataset_id, reason):
+                        evicted = dataset_id
+                        break
+
+            if evicted is None:
+                if metrics is True:
+                    DATASETS_OPEN.labels(**DEFAULT_LABELS).set(len(loaded))
+                    DATASETS_MEMORY.labels(**DEFAULT_LABELS).set(memory)
+                return
+
+    def evict_dataset(self, dataset_id: str, reason: str = 'manual', blocking: bool = False) -> bool:
+        """
+        Drop a loaded dataset and close its files. Returns False if the
+        dataset is being loaded by another thread, unless `blocking`
+        is set to wait for the load to finish.
+        """
+        lock = self.dataset_lock(dataset_id)
+        if not lock.acquire(blocking=blocking):
+            return False
+        try:
+            dataset = self.__datasets.pop(dataset_id, None)
+            self.__datasets_loaded.pop(dataset_id, None)
+            self.__datasets_memory.pop(dataset_id, None)
+            with self.__used_lock:
+                self.__datasets_used.pop(dataset_id, None)
+            with self.__extras_lock:
+                self.__datasets_extras.pop(dataset_id, None)
+            if dataset is None:
+                return False
+
+            L.info(f"Evicting dataset {dataset_id} ({reason})")
+            self.__datasets_status[dataset_id] = dict(state='evicted')
+            if metrics is True:
+                DATASET_EVICTIONS.labels(
+                    dataset=dataset_id,
+                    reason=reason,
+                    **DEFAULT_LABELS
+                ).inc()
+            # Requests still using the dataset re-open the files they read
+            dataset.close()
+            return True
+        finally:
+            lock.release()
+
+    def datasets_status(self) -> dict[str, dict]:
+        """
+        The load state of each dataset in this process: `not_loaded`, `loading`,
+        `loaded` or `failed`. Datasets loaded on startup are `required` for
+        the server to be ready and `available` is true when a (possibly
+        expired) copy of the dataset can be served.
+        """
+        now = datetime.now(timezone.utc).timestamp()
+        statuses = {}
+        for dsc in self.datasets_config.values():
+            current = self.__datasets_status.get(dsc.id, {})
+            status = dict(
+                state=current.get('state', 'not_loaded'),
+                # Evicted datasets are loaded again when they are requested
+                required=dsc.skip_initial_load is False and current.get('state') != 'evicted',
+                available=dsc.id in self.__datasets,
+            )
+            if 'loaded' in current:
+                status['age'] = round(now - current['loaded'], 3)
+            if current.get('state') == 'failed':
+                status['error'] = current.get('error')
+            statuses[dsc.id] = status
+        return statuses
+
+    def dataset_generation(self, dataset_id: str, dataset: xr.Dataset | None = None) -> int | None:
+        """
+        How many times a dataset has been loaded by this process, used by other
+        plugins to invalidate anything they derived from the previous dataset.
+
+        If `dataset` is passed and it is no longer the loaded dataset, None
+        is returned.
+        """
+        # Read the generation first, the dataset is replaced before
+        # the generation is incremented
+        generation = self.__datasets_generation.get(dataset_id)
+        if dataset is not None and self.__datasets.get(dataset_id) is not dataset:
+            return None
+        return generation
+
+    def dataset_extra(self, dataset_id: str, dataset: xr.Dataset, key: t.Hashable, factory):
+        """
+        Return an object derived from a loaded dataset (i.e. a spatial index),
+        calling `factory(dataset)` to build it the first time it is requested
+        after each load of the dataset. The objects are dropped when the dataset
+        is reloaded.
+
+        If `dataset` is no longer the loaded dataset, None is returned.
+        """
+        with self.__extras_lock:
+            owner, extras = self.__datasets_extras.get(dataset_id, (None, {}))
+            if owner is not dataset:
+                if self.__datasets.get(dataset_id) is not dataset:
+                    return None
+                extras = {}
+                self.__datasets_extras[dataset_id] = (dataset, extras)
+            entry = extras.setdefault(key, [threading.Lock(), None])
+
+        # Only build each object once, without blocking other datasets
+        lock, value = entry
+        if value is None:
+            with lock:
+                if entry[1] is None:
+                    entry[1] = factory(dataset)
+                value = entry[1]
+        return value
+
+    def reload_dataset_background(self, config: DatasetConfig):
+        """
+        Reload a dataset in a background thread. Only one reload per dataset
+        runs at a time, additional calls while a reload is in-flight are no-ops.
+        If the config of the dataset changed while it was reloading it is
+        reloaded again with the new config.
+        """
+        with self.__reload_lock:
+            if config.id in self.__datasets_reloading:
+                return False
+            self.__datasets_reloading.add(config.id)
+
+        def reload():
+            dsc = config
+            while True:
+                try:
+                    L.info(f"Loading dataset (background): {dsc.id}")
+                    self.load_dataset(dsc)
+                except BaseException as e:
+                    L.error(f"Could not reload dataset {dsc.id}, serving the stale dataset: {e}")
+                    # Back off for another invalidation period before trying again
+                    self.__datasets_loaded[dsc.id] = datetime.now(timezone.utc).timestamp()
+
+                with self.__reload_lock:
+                    latest = self.__configs.get(dsc.id)
+                    if latest is None or latest == dsc:
+                        self.__datasets_reloading.discard(dsc.id)
+                        return
+                L.info(f"Reloading dataset {dsc.id}, changed in the config file while loading")
+                dsc = latest
+
+        threading.Thread(
+            target=reload,
+            name=f'xpublish-reload-{config.id}',
+            daemon=True,
+        ).start()
+        return True
@@ -0,0 +1,127 @@
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    watchdog = True
+except ImportError:
+    FileSystemEventHandler = object
+    watchdog = False
+
+L = logging.getLogger(__name__)
+
+
+class FileWatcher:
+    """
+    Track when files matching `file_glob` under `root_path` last changed.
+
+    Changes are noticed through filesystem events (inotify on linux) when
+    `watchdog` is installed and `events` is set, otherwise the files are
+    scanned every `interval` seconds. A scan when the watcher starts picks
+    up changes made before it started. The watcher runs in daemon threads
+    started by `start`, which don't survive a fork, so each process starts
+    its own.
+    """
+
+    def __init__(
+        self,
+        root_path: str | Path,
+        file_glob: str,
+        interval: float = 10,
+        events: bool = True,
+    ):
+        self.root_path = Path(root_path)
+        self.file_glob = file_glob
+        self.interval = interval
+        self.events = events
+        # When a matching file was last added, modified or removed
+        self.last_change = 0.0
+        self._files: dict[str, tuple[float, int]] | None = None
+        self._observer = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        if self.events and watchdog is True:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(
+                    _EventHandler(self),
+                    str(self.root_path),
+                    recursive='**' in self.file_glob or '/' in self.file_glob,
+                )
+                self._observer.daemon = True
+                self._observer.start()
+            except OSError as e:
+                # i.e. out of inotify watches, scan for changes instead
+                L.warning(f"Could not watch {self.root_path}, scanning it instead: {e}")
+                self._observer = None
+
+        threading.Thread(
+            target=self._run,
+            name=f'xpublish-watch-{self.root_path.name}',
+            daemon=True,
+        ).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._observer is not None:
+            self._observer.stop()
+
+    def changed_after(self, timestamp: float) -> bool:
+        return self.last_change > timestamp
+
+    def matches(self, path: str | Path) -> bool:
+        path = Path(path)
+        return (
+            path.is_relative_to(self.root_path) and
+            path.match(Path(self.file_glob).name)
+        )
+
+    def changed(self):
+        self.last_change = time.time()
+
+    def scan(self):
+        files = {}
+        for path in self.root_path.glob(self.file_glob):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files[str(path)] = (stat.st_mtime, stat.st_size)
+
+        if self._files is None:
+            # Changes made before the watcher started
+            if files:
+                self.last_change = max(self.last_change, max(f[0] for f in files.values()))
+        elif files != self._files:
+            self.changed()
+        self._files = files
+
+    def _run(self):
+        # With watchdog only scan once, events are used after that
+        while True:
+            try:
+                self.scan()
+            except OSError as e:
+                L.warning(f"Could not scan {self.root_path} for changes: {e}")
+            if self._observer is not None or self._stopped.wait(self.interval):
+                return
+
+
+class _EventHandler(FileSystemEventHandler):
+
+    def __init__(self, watcher: FileWatcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type in ('opened', 'closed_no_write'):
+            return
+        paths = [ event.src_path, getattr(event, 'dest_path', '') ]
+        if any(p and self.watcher.matches(p) for p in paths):
+            self.watcher.changed()
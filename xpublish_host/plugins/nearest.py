@@ -0,0 +1,79 @@
+import logging
+
+import numpy as np
+import xarray as xr
+
+L = logging.getLogger(__name__)
+
+# Mean radius of the earth in meters
+EARTH_RADIUS = 6_371_000
+
+
+def to_xyz(lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+    """
+    Convert longitudes and latitudes to points on a unit sphere so euclidean
+    distances between them increase with the great-circle distance, including
+    across the antimeridian and near the poles
+    """
+    lons = np.deg2rad(np.asarray(lons, dtype=float))
+    lats = np.deg2rad(np.asarray(lats, dtype=float))
+    return np.column_stack([
+        np.cos(lats) * np.cos(lons),
+        np.cos(lats) * np.sin(lons),
+        np.sin(lats),
+    ])
+
+
+class NearestIndex:
+    """
+    A KD-tree of the horizontal grid cells of a dataset, used to find the grid
+    cells nearest to longitude and latitude points.
+
+    The longitude and latitude variables can be 1D along different dimensions
+    (rectilinear grids), 2D (curvilinear grids) or 1D along the same dimension
+    (unstructured grids). Cells with missing coordinates are never returned.
+    Building the tree is O(n log n) and each lookup is O(log n).
+    """
+
+    def __init__(self, lon: xr.DataArray, lat: xr.DataArray):
+        # Optional dependency, only needed for nearest point queries
+        from scipy.spatial import cKDTree
+
+        lon, lat = xr.broadcast(lon.reset_coords(drop=True), lat.reset_coords(drop=True))
+        self.dims = lon.dims
+        self.shape = lon.shape
+
+        lons = np.asarray(lon.values, dtype=float).ravel()
+        lats = np.asarray(lat.transpose(*self.dims).values, dtype=float).ravel()
+        self.cells = np.flatnonzero(np.isfinite(lons) & np.isfinite(lats))
+        if not self.cells.size:
+            raise ValueError("The grid does not have any valid coordinates")
+
+        L.info(f"Building nearest point index of {self.cells.size} cells along {self.dims}")
+        self.tree = cKDTree(to_xyz(lons[self.cells], lats[self.cells]))
+
+    def query(self, lons: list[float], lats: list[float]) -> tuple[dict[str, np.ndarray], np.ndarray]:
+        """
+        Return the index of the nearest grid cell to each point along each grid
+        dimension and the distance in meters from each point to its cell
+        """
+        chords, i = self.tree.query(to_xyz(lons, lats))
+        indexes = np.unravel_index(self.cells[i], self.shape)
+        distances = 2 * np.arcsin(np.clip(chords / 2, 0, 1)) * EARTH_RADIUS
+        return dict(zip(self.dims, indexes)), distances
+
+    def isel(self, ds: xr.Dataset, lons: list[float], lats: list[float]) -> xr.Dataset:
+        """
+        Select the grid cells nearest to each point along a new `point`
+        dimension. Only the chunks containing the cells are read.
+        """
+        indexes, distances = self.query(lons, lats)
+        ds = ds.isel({
+            d: xr.DataArray(v, dims='point')
+            for d, v in indexes.items()
+            if d in ds.dims
+        })
+        return ds.assign_coords(
+            point=np.arange(len(distances)),
+            distance=('point', distances),
+        )